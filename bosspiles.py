@@ -1,19 +1,30 @@
 """Bosspiles for use by BGA bosspiles discord server"""
-import logging
-from logging.handlers import RotatingFileHandler
+import io
+import itertools
 import re
+import sys
 
 import emoji
 
-LOG_FILENAME = 'errs'
-logger = logging.getLogger(__name__)
-handler = RotatingFileHandler(LOG_FILENAME, maxBytes=10000000, backupCount=0)
-formatter = logging.Formatter("%(asctime)s | %(name)s | %(levelname)s | %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
+from bosspiles_fuzzy import closest_keys
+from bosspiles_logging import get_logger
+
+UNKNOWN_PLAYER_LOG = "*Is `%s` a player on this server?*"
+UNMATCHED_LINE_LOG = "Line did not match regex `%s`"
+UNPARSABLE_LINE_MSG = """Unable to parse line `{}`.
+Player name can only contain alphanumeric characters, `_`, `.`, and spaces.
+Preferences must all be within one () and can contain alphanumeric characters, `,`, `_`, `:`, and spaces."""
+# Unknown players are logged for every match on every command, so only keep a sample
+logger = get_logger(__name__, sample_every=20, sampled_templates=[UNKNOWN_PLAYER_LOG, UNMATCHED_LINE_LOG])
 
 MINIMUM_BOSSPILE_PLAYERS = 3
+PREFERENCES_RE = re.compile(r" *\([^)]*\) *")
+PREFERENCE_GROUP_RE = re.compile(r"\(([^)]*)\)")
+
+
+def player_key(username):
+    """Case-folded player name without preferences, for matching a player across piles and history."""
+    return PREFERENCES_RE.sub("", username).strip().casefold()
 
 
 class PlayerData:
@@ -25,12 +36,42 @@ class PlayerData:
         self.climbing = climbing
         self.active = active
 
+    @property
+    def username(self):
+        return self._username
+
+    @username.setter
+    def username(self, username):
+        # Split once here (and again on every change) so that matching, tagging and status checks
+        # don't re-parse the username. Interned because the same players appear in every cached copy of a pile.
+        self._username = sys.intern(username)
+        self.name = sys.intern(PREFERENCES_RE.sub("", username))
+        self.preferences = tuple([sys.intern(preference.strip()) for group in PREFERENCE_GROUP_RE.findall(username)
+                                  for preference in group.split(",") if preference.strip()])
+        self.key = sys.intern(self.name.strip().casefold())
+
+    def fields(self):
+        """The player's own state, without the fields derived from the username."""
+        return {"username": self.username, "orange_diamonds": self.orange_diamonds,
+                "blue_diamonds": self.blue_diamonds, "climbing": self.climbing, "active": self.active}
+
+
+class PileEvent:
+    """One change made to the bosspile (win, crown, boss, diamond, add, remove, active) for the result history."""
+    def __init__(self, command, player, others=(), detail=""):
+        self.command = command
+        self.player = player
+        self.others = list(others)
+        self.detail = detail
+
 
 class BossPile:
     """Class to keep track of players and their rankings"""
-    def __init__(self, channel_name: str, nicknames, bosspile_text: str):
+    def __init__(self, channel_name: str, nicknames, bosspile_text):
+        self.channel_name = channel_name
         self.game = channel_name.replace('bosspile', '').replace('-', '')
         self.nicknames = nicknames
+        self.events = []
         # See regex w examples: https://regex101.com/r/iF4cVx/18, used to parse one player line
         # Combined line is `(?:^|\n)\s*~{0,2}\s*(?::[a-z_]*:\s?)*\s*((?:[\w._]\s*?)+(?:\([^()\n]*\))?)\s*(?::[\w_]*:)*\s*~{0,2}$`
         regex = r"""
@@ -49,8 +90,15 @@ class BossPile:
 $                           # End of line
 """
         self.player_line_re = re.compile(regex, re.VERBOSE)
+        # Set from the first line while parsing
+        self.title_line = ""
+        self.min_players = 2
+        self.max_players = 2
         self.players = self.parse_bosspile(bosspile_text)
-        self.title_line = bosspile_text.split('\n')[0]
+
+    def set_title(self, first_line):
+        """Keep the first line as the title if it is one, and read the player counts from it."""
+        self.title_line = first_line
         if "bosspile" not in self.title_line.lower():
             self.title_line = ""
         # always prefer more players
@@ -61,8 +109,16 @@ $                           # End of line
             self.min_players = int(matches[1])
             self.max_players = int(matches[2])
 
-    def find_player_pos(self, player_name):
-        """Find the player position in the player list or -1 and error"""
+    def find_player_pos(self, player_name, fuzzy=True, exact=False):
+        """Find the player position in the player list or -1 and error.
+        If no name starts with player_name, a unique close match (i.e. a typo) is used instead.
+        With exact, only the player whose whole name (preferences aside) is player_name matches."""
+        if exact:
+            key = player_key(player_name)
+            player_pos = next((i for i, player in enumerate(self.players) if player.key == key), -1)
+            if player_pos == -1:
+                return player_name, player_pos, f"Player {player_name} not found. No changes made."
+            return self.players[player_pos].username, player_pos, ""
         player_pos = -1
         err = ""
         actual_player_name = player_name  # in case player name is truncated (i.e. Po for Pocc)
@@ -76,9 +132,24 @@ $                           # End of line
                         f" at positions {player_pos} and {i}. No changes made."
                 player_pos = i
         if player_pos == -1:
+            if fuzzy:
+                return self.find_close_player_pos(player_name)
             return actual_player_name, player_pos, f"Player {player_name} not found. No changes made."
         return  actual_player_name, player_pos, err
 
+    def find_close_player_pos(self, player_name):
+        """Find the one player within a few typos of player_name, or -1 and suggestions."""
+        keys = [player.key for player in self.players]
+        close_keys = closest_keys(keys, player_key(player_name), owner=self.channel_name)
+        close_positions = [i for i, key in enumerate(keys) if key in close_keys]
+        if len(close_positions) == 1:
+            return self.players[close_positions[0]].username, close_positions[0], ""
+        err = f"Player {player_name} not found."
+        if close_positions:
+            suggestions = " or ".join([f"`{self.players[i].username}`" for i in close_positions])
+            err += f" Did you mean {suggestions}?"
+        return player_name, -1, err + " No changes made."
+
     def validate_win(self, victor, loser_positions, victor_pos):
         """Ensure that win meets parameters."""
         if victor_pos == -1:
@@ -133,10 +204,12 @@ $                           # End of line
         p1_name = self.players[victor_pos].username
         p2_name = self.players[loser_pos].username
         messages = [f"{p2_name} has lost the :crown: to {p1_name}"]
+        self.events.append(PileEvent("crown", p1_name, [p2_name]))
         new_blue_diamonds = self.players[loser_pos].orange_diamonds // 5
         self.players[loser_pos].orange_diamonds %= 5
         if new_blue_diamonds > 0:
             self.players[loser_pos].blue_diamonds += new_blue_diamonds
+            self.events.append(PileEvent("diamond", p2_name, detail="blue"))
             messages += [f"{p2_name} has gained a :large_blue_diamond: and is now at the bottom."]
             self.players = self.players[1:] + [self.players[0]]  # move player to end
         else:  # Move them down how many orange diamonds they gained + 1 fencepost error
@@ -171,6 +244,7 @@ $                           # End of line
             return err_msg
         loser_names = [self.players[pos].username for pos in loser_positions if self.players[pos].active]
         messages = [self.players[victor_pos].username + " defeats " + ', '.join(loser_names) + "\n"]
+        self.events.append(PileEvent("win", self.players[victor_pos].username, loser_names))
         self.players[victor_pos].climbing = True
         for pos in loser_positions:
             self.players[pos].climbing = False
@@ -192,71 +266,57 @@ $                           # End of line
             defended_str = " has defended the :crown: and gains :small_orange_diamond:"
             messages += [self.players[victor_pos].username + defended_str]
             self.players[victor_pos].orange_diamonds += 1
+            self.events.append(PileEvent("diamond", self.players[victor_pos].username, detail="orange"))
         self.set_climbing_invariants()
-        matches_text = self.get_matches_text(victor, loser_names[0])
+        matches_text = self.get_matches_text(victor, loser_names)
         paragraph_message = "\n".join(messages) + "\n" + matches_text
         paragraph_message += "\n\n" + self.generate_bosspile()
         return paragraph_message
 
-    def get_matches_text(self, victor, loser):
+    def get_matches_text(self, victor, losers):
+        """Describe every current table. Tables with the victor or a loser in them are new,
+        and their players are tagged if they're on this server."""
         matches = self.generate_matches()
-        if self.max_players > 2:  # Implement this later
-            match_texts = ["2+ player matchups partially implemented."]
-            for m in matches:
-                match_text = ":hourglass:"
-                for p in m:
-                    # Get rid of preferences in () in matchups
-                    match_text += " " + re.sub(r" \([^()]\)", "", p.username)
-                    if p != m[len(m)-1]:
-                        match_text += " :vs:"
-                match_texts.append(match_text)
-            return "\n".join(match_texts)
-        loser_id = 0
-        victor_id = 0
-        for ID in self.nicknames:
-            # There are sometimes extraneous information in the name in parentheses
-            # like what versions of the game somebody wants to play
-            if victor.lower().startswith(self.nicknames[ID].lower()):
-                victor_id = ID
-            if loser.lower().startswith(self.nicknames[ID].lower()):
-                loser_id = ID
+        # Display name => user id, so each player is looked up once
+        nickname_ids = {}
+        for user_id in self.nicknames:
+            nickname_ids[self.nicknames[user_id].lower()] = user_id
+        result_names = [victor, *losers]
+        result_keys = {player_key(name) for name in result_names}
+        result_ids = set()
+        for name in result_names:
+            name_id = -1
+            for user_id in self.nicknames:
+                # There are sometimes extraneous information in the name in parentheses
+                # like what versions of the game somebody wants to play
+                if name.lower().startswith(self.nicknames[user_id].lower()):
+                    name_id = user_id
+            result_ids.add(name_id)
+        result_ids.discard(-1)
         new_matches = []
         old_matches = []
 
         def tag_user(user_id, name, should_tag_user):
             if user_id == -1 or not should_tag_user:
                 # Prevent preferences from being added to player name
-                return re.sub(r" *\([^()]*\) *", "", name)
+                return name
             return "<@" + user_id + ">"
 
         for match in matches:
-            left_player, right_player = match
-            left_name = left_player.username
-            right_name = right_player.username
-            # Left and right ID are a different default than loser/winner so that
-            # The defaults cannot be equal
-            left_id = -1
-            right_id = -1
-            for userid in self.nicknames:
-                if left_name.lower() == self.nicknames[userid].lower():
-                    left_id = userid
-                if right_name.lower() == self.nicknames[userid].lower():
-                    right_id = userid
-            if left_id == -1:
-                logger.debug(f"*Is `{left_name}` a player on this server?*")
-            if right_id == -1:
-                logger.debug(f"*Is `{right_name}` a player on this server?*")
-            # Only tag the victor and the next person they face
-            new_games_from_win = (left_id == victor_id or right_id == victor_id
-                or left_id == loser_id or right_id == loser_id
-                or left_name.lower() == victor.lower() or left_name.lower() == loser.lower()
-                or right_name.lower() == victor.lower() or right_name.lower() == loser.lower())
-            left = tag_user(left_id, left_name, new_games_from_win)
-            right = tag_user(right_id, right_name, new_games_from_win)
+            names = [player.name for player in match]
+            ids = []
+            for name in names:
+                ids.append(nickname_ids.get(name.lower(), -1))
+                if ids[-1] == -1:
+                    logger.debug(UNKNOWN_PLAYER_LOG, name)
+            # Only tag the victor and the people they face next
+            new_games_from_win = any([user_id in result_ids for user_id in ids]) \
+                or any([player.key in result_keys for player in match])
+            match_text = " :vs: ".join([tag_user(user_id, name, new_games_from_win) for user_id, name in zip(ids, names)])
             if new_games_from_win:
-                new_matches += [f":crossed_swords: {left} :vs: {right}\n"]
+                new_matches += [f":crossed_swords: {match_text}\n"]
             else:
-                old_matches += [f":hourglass: {left} :vs: {right}"]
+                old_matches += [f":hourglass: {match_text}"]
         return "\n".join(new_matches + old_matches)
 
     def set_climbing_invariants(self):
@@ -269,7 +329,8 @@ $                           # End of line
         self.players[0].climbing = False
 
     def generate_matches(self):
-        """Create the matches based on who is climbing. Generates lists of matched players"""
+        """Create the matches based on who is climbing. Generates lists of matched players.
+        Tables are found in one pass up the ladder."""
         matches = []
         active_players = [p for p in self.players if p.active]
         counter = len(active_players) - 1  # start at bottom and go up; -1 fencepost error
@@ -288,12 +349,13 @@ $                           # End of line
     def add(self, player_name):
         """Add a player to the very end."""
         # Check that the player isn't already in the bosspile
-        player_name, pos, _ = self.find_player_pos(player_name)
+        player_name, pos, _ = self.find_player_pos(player_name, fuzzy=False)
         if pos != -1:
             return f"{player_name} is already in the bosspile. No changes made."
         new_player = PlayerData(player_name)
         self.players.append(new_player)
         self.players[-1].climbing = True  # by definition this new player is active
+        self.events.append(PileEvent("add", player_name))
         return f"{player_name} has been added successfully."
 
     def edit(self, old_line, new_line):
@@ -305,9 +367,7 @@ $                           # End of line
             if player:
                 self.players[old_player_pos] = player
             else:
-                return f"""Unable to parse line `{new_line}`.
-Player name can only contain alphanumeric characters, `_`, `.`, and spaces.
-Preferences must all be within one () and can contain alphanumeric characters, `,`, `_`, `:`, and spaces."""
+                return UNPARSABLE_LINE_MSG.format(new_line)
             self.set_climbing_invariants()
             return f"`{old_line}` is now️ `{new_line}`"
         elif len(err_msg) > 0:
@@ -333,19 +393,38 @@ Preferences must all be within one () and can contain alphanumeric characters, `
         self.players.insert(new_pos, moving_player)
         return f"Successfully moved {player} {relative_pos} spaces"
 
-    def remove(self, player_name):
+    def rename(self, player_name, new_name):
+        """Rename a player, keeping their diamonds, status and preferences."""
+        player_name, player_pos, err = self.find_player_pos(player_name, exact=True)
+        if len(err) > 0:
+            return err
+        if self.find_player_pos(new_name, exact=True)[1] not in (-1, player_pos):
+            return f"{new_name} is already in the bosspile. No changes made."
+        old_player = self.players[player_pos]
+        new_username = new_name + old_player.username[len(old_player.name.rstrip()):]
+        # The new name has to read back from the pile as the same player, like an edited line
+        parsed = self.parse_bosspile_line(new_username)
+        if not parsed or parsed.username != new_username or not parsed.active \
+                or parsed.orange_diamonds or parsed.blue_diamonds:
+            return UNPARSABLE_LINE_MSG.format(new_username)
+        self.players[player_pos] = PlayerData(new_username, old_player.orange_diamonds, old_player.blue_diamonds,
+                                              old_player.climbing, old_player.active)
+        return f"{player_name} is now {new_username}."
+
+    def remove(self, player_name, exact=False):
         """Delete a player from the leaderboard. Returns whether there was a successful deletion or not."""
         if len(self.players) <= MINIMUM_BOSSPILE_PLAYERS:
             return f"A bosspile must have at least {MINIMUM_BOSSPILE_PLAYERS} players. Skipping player deletion."
-        player_name, player_pos, err = self.find_player_pos(player_name)
+        player_name, player_pos, err = self.find_player_pos(player_name, exact=exact)
         if len(err) > 0:
             return err
         del self.players[player_pos]
+        self.events.append(PileEvent("remove", player_name))
         return f"{player_name} has been removed."
 
-    def change_active_status(self, player_name, is_active):
+    def change_active_status(self, player_name, is_active, exact=False):
         """Make a player active/inactive."""
-        player_name, player_pos, err = self.find_player_pos(player_name)
+        player_name, player_pos, err = self.find_player_pos(player_name, exact=exact)
         if len(err) > 0:
             return err
         self.players[player_pos].active = is_active
@@ -353,25 +432,45 @@ Preferences must all be within one () and can contain alphanumeric characters, `
         if player_pos == 0:  # If boss is made inactive, move them down a spot
             self.players = [self.players[1], self.players[0], *self.players[2:]]
         self.set_climbing_invariants()
+        self.events.append(PileEvent("active", username, detail=str(is_active).lower()))
         return f"{username} is now {'in'*(not is_active)}active."
 
-    def parse_bosspile(self, bosspile_text: str):
-        """Read the bosspile text and convert it into players"""
-        # Crown is pointless because it only signifies leader
-        bosspile_text = bosspile_text.replace(":crown:", "")
-        player_lines = bosspile_text.strip().split('\n')
-        player_lines = list(filter(None, player_lines))  # Removes empty values
-        all_player_data = []
-        for player_line in player_lines:
+    def parse_bosspile(self, bosspile_text):
+        """Read the bosspile text (or file object/iterable of lines) and convert it into players"""
+        return list(self.iter_players(bosspile_text))
+
+    def iter_players(self, bosspile_lines):
+        """Lazily parse players from the bosspile text or any iterable of lines, like a file object.
+        The title is read from the first line and the King/Pauper climbing invariants are applied
+        as players go by, so the text is only read once and never split up front."""
+        if isinstance(bosspile_lines, str):
+            bosspile_lines = io.StringIO(bosspile_lines)
+        lines = iter(bosspile_lines)
+        first_line = next(lines, "").rstrip("\n")
+        self.set_title(first_line)
+        seen_content = False
+        previous_player = None
+        for player_line in itertools.chain([first_line], lines):
+            # Crown is pointless because it only signifies leader
+            player_line = player_line.rstrip("\n").replace(":crown:", "")
+            if not seen_content:  # Leading whitespace before the first line is not part of it
+                player_line = player_line.lstrip()
+            if not player_line:
+                continue
+            seen_content = True
             line_is_heading = player_line[0] in ['-', '=']
             if not line_is_heading:
                 player = self.parse_bosspile_line(player_line)
                 if player:
-                    all_player_data.append(player)
-        # These are invariant climbing statuses for King/Pauper
-        all_player_data[0].climbing = False
-        all_player_data[-1].climbing = True
-        return all_player_data
+                    # Hold each player back one line so the last one can be marked as the Pauper
+                    if previous_player is None:
+                        player.climbing = False  # King
+                    else:
+                        yield previous_player
+                    previous_player = player
+        if previous_player is not None:
+            previous_player.climbing = True  # Pauper
+            yield previous_player
 
     def parse_bosspile_line(self, player_line_initial: str):
         """Parse one line of the bosspile and return a player line."""
@@ -385,20 +484,27 @@ Preferences must all be within one () and can contain alphanumeric characters, `
             username = matches[0]
         else:
             if not player_line.startswith("__**"):  # bosspile standing line
-                logger.debug(f"Line did not match regex `{player_line}`")
+                logger.debug(UNMATCHED_LINE_LOG, player_line)
             return None
         active = ":timer:" not in player_line and "__" not in player_line
         climbing = active and (":arrow_double_up:" in player_line or ":thought_balloon:" in player_line)
         player = PlayerData(username, orange_diamonds, blue_diamonds, climbing, active)
         return player
 
+    def boss(self):
+        """Username of the player with the crown (the first active player), or None."""
+        return next((player.username for player in self.players if player.active), None)
+
     def generate_bosspile(self):
         """Generate the bosspile text from the stored configuration."""
+        return "".join(self.iter_bosspile_lines())
+
+    def iter_bosspile_lines(self):
+        """Generate the bosspile text one line at a time, so it can be joined once or chunked as it's rendered."""
         if self.title_line:
-            bosspile_text = self.title_line
+            yield self.title_line + "\n\n"
         else:
-            bosspile_text = "__**Bosspile Standings**__"
-        bosspile_text += "\n\n"
+            yield "__**Bosspile Standings**__\n\n"
         crown_placed = False  # crown should only be placed on first active player
         prev_player_climbing = False
         for player in self.players:
@@ -408,8 +514,7 @@ Preferences must all be within one () and can contain alphanumeric characters, `
                 if not crown_placed:
                     bosspile_line = ":crown: " + bosspile_line
                     crown_placed = True
-            bosspile_text += bosspile_line
-        return bosspile_text
+            yield bosspile_line
 
     @staticmethod
     def generate_bosspile_line(player, prev_player_climbing=False):
@@ -437,3 +542,50 @@ Preferences must all be within one () and can contain alphanumeric characters, `
             bosspile_line += ":timer:~~"
         bosspile_line += '\n'
         return bosspile_line
+
+
+def is_valid_bosspile(pin_text):
+    if '\n' not in pin_text:
+        return False
+    first_line = pin_text.lower().split('\n')[0]
+    has_crown = "\n:crown:" in pin_text or "\n👑" in pin_text
+    has_title = 'bosspile' in first_line or 'ladder' in first_line
+    has_winners = ":small_orange_diamond:" in pin_text or "🔸" in pin_text
+    has_climbers = "arrow_double_up" in pin_text or "⏫" in pin_text
+    return has_crown and has_title and (has_winners or has_climbers)
+
+
+def generate_status_checks(channel_name, nicknames, pin_content):
+    game_name = re.sub(r'[^-]?bosspile', "", channel_name).replace('-', '')
+    bosspile = BossPile(channel_name, nicknames, pin_content)
+    matches = bosspile.generate_matches()
+    status_checks = []
+    for match in matches:
+        player_names = [player.name for player in match]
+        player_text = '" "'.join(player_names)  # space between all players, quote player names
+        status_checks.append(f'!status {game_name} "{player_text}"')
+    return status_checks
+
+
+def run_pile_command(bosspile, args):
+    """Apply a parsed $ command that changes the pile and return the reply, or None if args[0] isn't one.
+    The bot and the offline replay tools both go through this so they can't disagree."""
+    command = args[0].lower()
+    if "win".startswith(command):
+        return bosspile.win(' '.join(args[1:]))
+    elif "new".startswith(command):
+        return bosspile.add(' '.join(args[1:]))
+    elif "edit".startswith(command):
+        if len(args) != 3:
+            return f"`${args[0]}` requires 2 arguments. See `$`."
+        return bosspile.edit(args[1], args[2])
+    elif "move".startswith(command):
+        return bosspile.move(' '.join(args[1:-1]), args[-1])
+    elif "remove".startswith(command):
+        return bosspile.remove(' '.join(args[1:]))
+    elif "active".startswith(command):
+        if len(args) < 3:
+            return f"`${args[0]}` requires 2 arguments. See `$`."
+        state = args[-1].lower().startswith("t")  # t for true, anything else is false
+        return bosspile.change_active_status(' '.join(args[1:-1]), state)
+    return None
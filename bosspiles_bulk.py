@@ -0,0 +1,65 @@
+"""One admin operation (rename, remove or make inactive) applied to a player on every pile in a guild.
+
+The Discord side fetches and saves the piles; this module decides what happens to each one and
+summarises the results in one message, so that a dry run and the real run report the same diff."""
+import difflib
+
+BULK_OPERATIONS = ["rename", "remove", "inactive"]
+# Arguments each operation takes after its name: the player, and the new name for rename
+BULK_OPERATION_ARGS = {"rename": 2, "remove": 1, "inactive": 1}
+# Channels fetched and updated at once
+BULK_CONCURRENCY = 4
+
+
+def bulk_operation_name(arg):
+    """Full operation name for a (possibly shortened) argument, or None."""
+    return next((operation for operation in BULK_OPERATIONS if operation.startswith(arg.lower())), None)
+
+
+def check_bulk_args(operation, args):
+    """An error message if args (after the operation, without `confirm`) aren't exactly the ones it takes, else ""."""
+    if operation is None:
+        return "`$bulk` requires `rename <player> <new name>`, `remove <player>` or `inactive <player>`, " \
+            "then `confirm` to apply it. See `$`."
+    if len(args) != BULK_OPERATION_ARGS[operation]:
+        usage = "rename <player> <new name>" if operation == "rename" else f"{operation} <player>"
+        return f"`$bulk {usage}` takes {BULK_OPERATION_ARGS[operation]} names. Quote names with spaces, " \
+            f"like `$bulk rename \"Old Name\" \"New Name\"`."
+    return ""
+
+
+def apply_bulk_operation(bosspile, operation, player, new_name=""):
+    """Apply the operation to the player on this pile. Returns the reply, or None if they aren't on it.
+    The player must match a whole name (preferences aside), since a prefix could be someone else on another pile."""
+    if bosspile.find_player_pos(player, exact=True)[1] == -1:
+        return None
+    if operation == "rename":
+        return bosspile.rename(player, new_name)
+    elif operation == "remove":
+        return bosspile.remove(player, exact=True)
+    return bosspile.change_active_status(player, False, exact=True)
+
+
+def pile_diff(old_pile, new_pile):
+    """The lines removed from and added to a pile, as `- line` and `+ line`."""
+    return [line.rstrip("\n") for line in difflib.ndiff(old_pile.splitlines(), new_pile.splitlines())
+            if line.startswith(("- ", "+ "))]
+
+
+def format_bulk_summary(operation, player, results, dry_run):
+    """One message for every channel's result. results is [(channel name, reply or None, diff lines, error or None)],
+    where error is why the channel couldn't be read or saved."""
+    lines = [f"__**Bulk {operation} of {player}{' (dry run, add `confirm` to apply)' if dry_run else ''}**__"]
+    not_on_pile = []
+    for channel_name, reply, diff, error in sorted(results, key=lambda result: result[0]):
+        if error is not None:
+            lines.append(f"#{channel_name}: failed, no changes made: {error}")
+        elif reply is None:
+            not_on_pile.append(channel_name)
+        elif diff:
+            lines.append(f"#{channel_name}: " + "  ".join([f"`{line}`" for line in diff]))
+        else:
+            lines.append(f"#{channel_name}: {reply}")
+    if not_on_pile:
+        lines.append(f"Not on {len(not_on_pile)} other piles.")
+    return "\n".join(lines)
@@ -0,0 +1,120 @@
+"""Validate, normalise and re-render exported bosspiles without the bot, across a process pool.
+
+Each pile file is parsed with BossPile, optionally has a result log replayed against it, and is
+written back out in the bot's format along with its current matches and `!status` lines.
+The channel name is the file name without its extension, as it would be on Discord.
+
+    python bosspiles_cli.py exports/ --out normalised/ --replay logs/
+    find exports -name '*.txt' | python bosspiles_cli.py -"""
+import argparse
+import concurrent.futures
+import os
+import shlex
+import sys
+import time
+
+from bosspiles import BossPile, generate_status_checks, is_valid_bosspile, run_pile_command
+
+PILE_EXTENSIONS = (".txt", ".md")
+REPLAY_EXTENSION = ".log"
+# Files handed to each worker at a time; piles are small so this amortises the pickling
+CLI_CHUNK_SIZE = 8
+REPLAY_COMMANDS = ["win", "new", "edit", "move", "remove", "active"]
+
+
+def find_pile_files(inputs):
+    """Pile file paths from files, directories (not recursive) or `-` for paths on stdin."""
+    paths = []
+    for given in inputs:
+        if given == "-":
+            paths += [line.strip() for line in sys.stdin if line.strip()]
+        elif os.path.isdir(given):
+            paths += sorted([os.path.join(given, name) for name in os.listdir(given)
+                             if name.endswith(PILE_EXTENSIONS)])
+        else:
+            paths.append(given)
+    return paths
+
+
+def replay_command(bosspile, command_line):
+    """Apply one `$` command from a result log, the way the bot would. Returns the reply."""
+    args = shlex.split(command_line.lstrip("$"))
+    reply = run_pile_command(bosspile, args) if args else None
+    if reply is None:
+        return f"`{command_line}` is not a command that changes the bosspile."
+    return reply
+
+
+def process_pile_file(path, replay_dir=None):
+    """Result for one pile file: {path, channel, pile, matches, status_checks, unchanged, errors}.
+    Log lines the bot also rejected (so didn't change the pile) are listed in unchanged, not errors."""
+    channel_name = os.path.splitext(os.path.basename(path))[0]
+    result = {"path": path, "channel": channel_name, "pile": "", "matches": [], "status_checks": [], "unchanged": [],
+              "errors": []}
+    try:
+        with open(path, encoding="utf-8") as f:
+            pile_text = f.read()
+        if not is_valid_bosspile(pile_text):
+            result["errors"].append("not a valid bosspile (needs a title, a :crown: and a climber or diamond)")
+            return result
+        bosspile = BossPile(channel_name, {}, pile_text)
+        replay_path = replay_dir and os.path.join(replay_dir, channel_name + REPLAY_EXTENSION)
+        if replay_path and os.path.exists(replay_path):
+            with open(replay_path, encoding="utf-8") as f:
+                for line_num, command_line in enumerate(f, 1):
+                    if not command_line.strip():
+                        continue
+                    before = bosspile.generate_bosspile()
+                    reply = replay_command(bosspile, command_line.strip())
+                    if bosspile.generate_bosspile() == before:
+                        result["unchanged"].append(f"{os.path.basename(replay_path)}:{line_num}: no change: {reply.splitlines()[0]}")
+        result["pile"] = bosspile.generate_bosspile()
+        result["matches"] = [" :vs: ".join([player.username for player in match]) for match in bosspile.generate_matches()]
+        result["status_checks"] = generate_status_checks(channel_name, {}, result["pile"])
+    except Exception as e:  # One bad file shouldn't stop the batch
+        result["errors"].append(f"{type(e).__name__}: {e}")
+    return result
+
+
+def process_pile_files(paths, replay_dir=None, jobs=None):
+    """Process pile files across a process pool, yielding results in the order of paths."""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(process_pile_file, paths, [replay_dir] * len(paths), chunksize=CLI_CHUNK_SIZE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate, normalise and re-render exported bosspiles.")
+    parser.add_argument("inputs", nargs="+", help="pile files, directories of them, or - to read paths from stdin")
+    parser.add_argument("--out", help="directory to write normalised piles to (by default they are printed)")
+    parser.add_argument("--replay", help="directory of <channel>.log result logs, one $ command per line")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+    paths = find_pile_files(args.inputs)
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    started = time.perf_counter()
+    num_failed = 0
+    for result in process_pile_files(paths, args.replay, args.jobs):
+        if args.out and result["pile"]:
+            with open(os.path.join(args.out, os.path.basename(result["path"])), "w", encoding="utf-8") as f:
+                f.write(result["pile"])
+        elif result["pile"]:
+            print(f"==> {result['path']} <==\n{result['pile']}")
+        for match in result["matches"]:
+            print(f"{result['channel']}: {match}")
+        for status_check in result["status_checks"]:
+            print(status_check)
+        for unchanged in result["unchanged"]:
+            print(f"{result['path']}: {unchanged}", file=sys.stderr)
+        if result["errors"]:
+            num_failed += 1
+            for error in result["errors"]:
+                print(f"{result['path']}: {error}", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    print(f"Processed {len(paths)} piles ({num_failed} with errors) in {elapsed:.2f}s, "
+          f"{len(paths) / elapsed if elapsed else 0:.1f} piles/s", file=sys.stderr)
+    return 1 if num_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""Per-channel locks and run-once claims shared by every shard process of one deployment.
+
+Discord gives each guild to exactly one shard, but while shards restart or reconnect two processes
+can briefly serve the same guild. Commands hold their channel's lock and weekly status checks claim
+their channel for the week, so both still happen once per channel.
+
+The coordinator is a small JSON lines server on localhost run by bosspiles_deploy.py. Locks held by a
+shard are released if its connection drops, and a shard that loses its connection uses in-process locks
+and claims until it reconnects. A single process uses LocalCoordinator instead."""
+import asyncio
+import contextlib
+import itertools
+import json
+import time
+
+from bosspiles_logging import get_logger
+
+COORDINATOR_HOST = '127.0.0.1'
+# Below METRICS_PORT, so it never collides with a shard's metrics port however many shards there are
+COORDINATOR_PORT = 9476
+# Set by bosspiles_deploy.py for each shard process
+SHARD_ID_ENV = "BOSSPILES_SHARD_ID"
+SHARD_COUNT_ENV = "BOSSPILES_SHARD_COUNT"
+COORDINATOR_PORT_ENV = "BOSSPILES_COORDINATOR_PORT"
+# Claims are forgotten after this long, which is longer than the weekly status check they guard
+CLAIM_TTL = 8 * 24 * 60 * 60
+# Seconds between attempts to reconnect to the coordinator: base * 2 ** attempts, up to the max
+RECONNECT_BASE = 1
+RECONNECT_MAX = 60
+
+logger = get_logger(__name__)
+
+
+def shard_for_guild(guild_id, shard_count):
+    """The shard Discord sends a guild's events to."""
+    return (guild_id >> 22) % shard_count
+
+
+def claim_key(claims, key, ttl=CLAIM_TTL):
+    """Claim key in claims ({key: expiry}), dropping expired claims. True if it wasn't already claimed."""
+    now = time.monotonic()
+    for expired in [claimed for claimed, expiry in claims.items() if expiry <= now]:
+        del claims[expired]
+    if key in claims:
+        return False
+    claims[key] = now + ttl
+    return True
+
+
+class LocalCoordinator:
+    """Locks and claims within one process."""
+    def __init__(self):
+        self.locks = {}
+        self.claims = {}
+
+    async def claim(self, key):
+        """True the first time key is claimed (until the claim expires), False after."""
+        return claim_key(self.claims, key)
+
+    @contextlib.asynccontextmanager
+    async def channel_lock(self, key):
+        async with self.locks.setdefault(key, asyncio.Lock()):
+            yield
+
+    async def close(self):
+        pass
+
+
+class CoordinatorServer:
+    """Grants locks and claims to shard connections. Requests are {"id", "op", "key"} and each is answered
+    with {"id", "ok"} once done, so one connection can wait on a lock while making other requests."""
+    def __init__(self):
+        self.locks = {}
+        self.owners = {}
+        self.claims = {}
+        self.server = None
+
+    async def start(self, host=COORDINATOR_HOST, port=COORDINATOR_PORT):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_connection(self, reader, writer):
+        connection = object()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self.answer(connection, json.loads(line), writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            for key, owner in list(self.owners.items()):
+                if owner is connection:
+                    self.unlock(key)
+            writer.close()
+
+    async def answer(self, connection, request, writer):
+        op, key = request["op"], request["key"]
+        if op == "lock":
+            await self.locks.setdefault(key, asyncio.Lock()).acquire()
+            self.owners[key] = connection
+            ok = True
+        elif op == "unlock":
+            ok = self.owners.get(key) is connection
+            if ok:
+                self.unlock(key)
+        else:
+            ok = claim_key(self.claims, key)
+        writer.write(json.dumps({"id": request["id"], "ok": ok}).encode() + b"\n")
+
+    def unlock(self, key):
+        del self.owners[key]
+        self.locks[key].release()
+
+
+class CoordinatorClient:
+    """One shard's connection to the CoordinatorServer, with the same interface as LocalCoordinator.
+    While the connection is down, locks and claims fall back to a LocalCoordinator and it reconnects in the background."""
+    def __init__(self, host=COORDINATOR_HOST, port=COORDINATOR_PORT):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.ids = itertools.count()
+        self.pending = {}
+        self.responses = None
+        self.fallback = LocalCoordinator()
+        self.reconnecting = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.pending = {}
+        self.responses = asyncio.ensure_future(self.read_responses())
+        return self
+
+    def is_connected(self):
+        return self.responses is not None and not self.responses.done()
+
+    async def read_responses(self):
+        while True:
+            try:
+                line = await self.reader.readline()
+            except ConnectionError:
+                break
+            if not line:
+                break
+            response = json.loads(line)
+            self.pending.pop(response["id"]).set_result(response["ok"])
+        for future in self.pending.values():
+            future.set_exception(ConnectionError("Lost the connection to the coordinator"))
+
+    async def request(self, op, key):
+        if not self.is_connected():
+            raise ConnectionError("Lost the connection to the coordinator")
+        request_id = next(self.ids)
+        future = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(json.dumps({"id": request_id, "op": op, "key": key}).encode() + b"\n")
+        return await future
+
+    def lost_connection(self):
+        """Start reconnecting, unless that's already happening."""
+        if self.reconnecting is None or self.reconnecting.done():
+            logger.warning("Lost the connection to the coordinator, using in-process locks until it is back")
+            self.reconnecting = asyncio.ensure_future(self.reconnect())
+
+    async def reconnect(self):
+        for attempt in itertools.count():
+            await asyncio.sleep(min(RECONNECT_MAX, RECONNECT_BASE * 2 ** attempt))
+            try:
+                await self.connect()
+            except OSError as e:
+                logger.warning("Could not reconnect to the coordinator: %s", e)
+                continue
+            logger.warning("Reconnected to the coordinator")
+            return
+
+    async def claim(self, key):
+        try:
+            return await self.request("claim", key)
+        except ConnectionError:
+            self.lost_connection()
+            return await self.fallback.claim(key)
+
+    @contextlib.asynccontextmanager
+    async def channel_lock(self, key):
+        try:
+            locked = await self.request("lock", key)
+        except ConnectionError:
+            self.lost_connection()
+            locked = False
+        if not locked:
+            async with self.fallback.channel_lock(key):
+                yield
+            return
+        try:
+            yield
+        finally:
+            with contextlib.suppress(ConnectionError):  # The server releases a dropped connection's locks itself
+                await self.request("unlock", key)
+
+    async def close(self):
+        if self.reconnecting:
+            self.reconnecting.cancel()
+        if self.writer:
+            self.writer.close()
+        if self.responses:
+            await self.responses
@@ -0,0 +1,114 @@
+"""Run the bot as several shard processes that share one coordinator.
+
+Each shard is bosspiles_discord.py with BOSSPILES_SHARD_ID and BOSSPILES_SHARD_COUNT set, so Discord
+spreads guilds across the processes and each keeps its own piles, member names and event loop.
+A shard that exits is restarted and all of them are stopped with the launcher. Each shard logs to its own errs file
+and serves metrics on its own port.
+
+    python bosspiles_deploy.py --shards 4
+
+simulate_deployment runs the same coordination in worker processes without Discord, for tests."""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from bosspiles_coordinator import (COORDINATOR_PORT, COORDINATOR_PORT_ENV, SHARD_COUNT_ENV, SHARD_ID_ENV, CoordinatorClient,
+                                   CoordinatorServer, shard_for_guild)
+from bosspiles_logging import LOG_FILENAME_ENV
+from bosspiles_metrics import METRICS_PORT, METRICS_PORT_ENV
+
+SHARD_RESTART_DELAY = 10
+
+
+def metrics_port(shard_id, coordinator_port):
+    """The port shard_id serves metrics on: METRICS_PORT + shard_id, skipping the coordinator's port."""
+    port = METRICS_PORT + shard_id
+    return port + 1 if METRICS_PORT <= coordinator_port <= port else port
+
+
+async def run_shard(shard_id, shard_count, port):
+    """Keep one shard process running."""
+    env = dict(os.environ)
+    env.update({SHARD_ID_ENV: str(shard_id), SHARD_COUNT_ENV: str(shard_count), COORDINATOR_PORT_ENV: str(port),
+                METRICS_PORT_ENV: str(metrics_port(shard_id, port)), LOG_FILENAME_ENV: f"errs.shard{shard_id}"})
+    while True:
+        process = await asyncio.create_subprocess_exec(sys.executable, "-u", "bosspiles_discord.py", env=env)
+        try:
+            return_code = await process.wait()
+        except asyncio.CancelledError:
+            process.terminate()
+            await process.wait()
+            raise
+        print(f"Shard {shard_id} exited with {return_code}, restarting in {SHARD_RESTART_DELAY}s", flush=True)
+        await asyncio.sleep(SHARD_RESTART_DELAY)
+
+
+async def run_deployment(shard_count, port=COORDINATOR_PORT):
+    server = CoordinatorServer()
+    await server.start(port=port)
+    shards = asyncio.gather(*[run_shard(shard_id, shard_count, port) for shard_id in range(shard_count)])
+    asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, shards.cancel)
+    try:
+        await shards
+    except asyncio.CancelledError:
+        pass
+    await server.close()
+
+
+def simulated_shard(shard_id, port, guild_channels, events):
+    """A shard without Discord. It claims the weekly status check for every channel it's given
+    and runs a command in each under the channel lock, recording (channel, shard, step, monotonic time) in events."""
+    async def run():
+        coordinator = await CoordinatorClient(port=port).connect()
+
+        async def run_command(channel):
+            async with coordinator.channel_lock(f"channel:{channel}"):
+                events.put((channel, shard_id, "start", time.monotonic()))
+                await asyncio.sleep(0.01)  # Long enough for another shard to try the same channel
+                events.put((channel, shard_id, "end", time.monotonic()))
+
+        channels = [channel for channels in guild_channels.values() for channel in channels]
+        for channel in channels:
+            if await coordinator.claim(f"status:{channel}:2026-W01"):
+                events.put((channel, shard_id, "status", time.monotonic()))
+        await asyncio.gather(*[run_command(channel) for channel in channels])
+        await coordinator.close()
+    asyncio.run(run())
+
+
+def simulate_deployment(shard_count, guild_channels, overlap=True):
+    """Run shard_count simulated shards against one coordinator and return their events.
+    guild_channels is {guild id: [channel name]}. With overlap every shard is given every guild,
+    as if all of them were mid-reconnect; otherwise each gets the guilds Discord would give it."""
+    async def run():
+        server = CoordinatorServer()
+        port = await server.start(port=0)
+        events = multiprocessing.Queue()
+        workers = []
+        for shard_id in range(shard_count):
+            shard_guilds = {guild_id: channels for guild_id, channels in guild_channels.items()
+                            if overlap or shard_for_guild(guild_id, shard_count) == shard_id}
+            workers.append(multiprocessing.Process(target=simulated_shard, args=(shard_id, port, shard_guilds, events)))
+        for worker in workers:
+            worker.start()
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[loop.run_in_executor(None, worker.join) for worker in workers])
+        await server.close()
+        return [events.get() for _ in range(events.qsize())]
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bosspiles bot as several shard processes.")
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--port", type=int, default=COORDINATOR_PORT, help="local port for the coordinator")
+    args = parser.parse_args()
+    asyncio.run(run_deployment(args.shards, args.port))
+
+
+if __name__ == "__main__":
+    main()
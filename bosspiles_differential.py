@@ -0,0 +1,190 @@
+"""Randomized differential testing of BossPile against the frozen ReferenceBossPile.
+
+Random ladders (inactive players, headings, multiplayer titles, lots of diamonds) and server nicknames
+for some of their players are driven through random command sequences, with some typos, on both engines.
+After every command the replies and the rendered piles must match. A divergence is shrunk to a minimal
+ladder and command list before it's reported.
+
+    python bosspiles_differential.py --iterations 5000 --seed 1"""
+import argparse
+import random
+import string
+
+from bosspiles import BossPile
+from bosspiles_reference import ReferenceBossPile
+
+DIFFERENTIAL_ITERATIONS = 1000
+MAX_LADDER_PLAYERS = 14
+MAX_COMMANDS = 12
+TITLES = ["__**Bosspile Standings**__", "__**Azul bosspile (2-2)**__", "__**Potion Explosion bosspile (3-3)**__",
+          "__**Can't Stop bosspile (2-4)**__", "__**Ra bosspile (3-5)**__", "Not a title"]
+
+
+def random_name(rng):
+    # Same length names so that no name is a prefix of another
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(6))
+
+
+def random_player_line(rng, name):
+    """One pile line for name, with random diamonds, preferences and status."""
+    line = ":large_blue_diamond: " * rng.choice([0, 0, 0, 1, 3])
+    line += ":small_orange_diamond: " * rng.choice([0, 0, 1, 4, 9, 12])
+    line += name
+    if rng.random() < 0.2:
+        line += " (2P ok, no expansions)"
+    roll = rng.random()
+    if roll < 0.15:
+        return f"~~{line}:timer:~~"
+    if roll < 0.55:
+        return line + rng.choice([" :arrow_double_up:", " :thought_balloon:"])
+    return line
+
+
+def random_ladder(rng):
+    """(pile text, player names) for a random ladder."""
+    num_players = rng.randint(3, MAX_LADDER_PLAYERS)
+    names = []
+    while len(names) < num_players:
+        name = random_name(rng)
+        if name not in names:
+            names.append(name)
+    lines = [rng.choice(TITLES), ""]
+    for i, name in enumerate(names):
+        if i > 0 and rng.random() < 0.08:
+            lines.append(rng.choice(["", "__Division 2__", "-------"]))
+        lines.append(random_player_line(rng, name))
+    return "\n".join(lines), names
+
+
+def random_nicknames(rng, names):
+    """{user id: display name} for about half of the players, in any case, some only a prefix of the name,
+    and one member who isn't on the ladder."""
+    nicknames = {"999": random_name(rng)}
+    for user_id, name in enumerate(names):
+        roll = rng.random()
+        if roll < 0.4:
+            nicknames[str(user_id)] = name if rng.random() < 0.5 else name.upper()
+        elif roll < 0.5:
+            nicknames[str(user_id)] = name[:4]
+    return nicknames
+
+
+def typo(rng, name):
+    """name with one character changed."""
+    i = rng.randrange(len(name))
+    return name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:]
+
+
+def random_commands(rng, names):
+    """Random `(command, *args)` tuples. Most are wins, since that's where the ranking rules are."""
+    names = list(names)
+    commands = []
+    for _ in range(rng.randint(1, MAX_COMMANDS)):
+        roll = rng.random()
+        name = rng.choice(names)
+        if roll < 0.7:
+            name_roll = rng.random()
+            commands.append(("win", name if name_roll < 0.9 else typo(rng, name) if name_roll < 0.95 else random_name(rng)))
+        elif roll < 0.8:
+            commands.append(("active", name, rng.random() < 0.5))
+        elif roll < 0.87:
+            new_name = random_name(rng)
+            names.append(new_name)
+            commands.append(("add", new_name))
+        elif roll < 0.93:
+            commands.append(("remove", name))
+        else:
+            commands.append(("move", name, str(rng.randint(-3, 3))))
+    return commands
+
+
+def run_commands(engine, pile_text, commands, nicknames=None):
+    """[(reply, pile text)] after each command. Exceptions are part of the result, by type."""
+    try:
+        bosspile = engine("differential", nicknames or {}, pile_text)
+    except Exception as exc:  # pylint: disable=broad-except
+        return [(f"raised {type(exc).__name__}", "")]
+    results = []
+    for command, *args in commands:
+        try:
+            if command == "win":
+                reply = bosspile.win(*args)
+            elif command == "active":
+                reply = bosspile.change_active_status(*args)
+            elif command == "add":
+                reply = bosspile.add(*args)
+            elif command == "remove":
+                reply = bosspile.remove(*args)
+            else:
+                reply = bosspile.move(*args)
+        except Exception as exc:  # pylint: disable=broad-except
+            results.append((f"raised {type(exc).__name__}", ""))
+            break
+        results.append((reply, bosspile.generate_bosspile()))
+    return results
+
+
+def diverges(pile_text, commands, engine=BossPile, reference=ReferenceBossPile, nicknames=None):
+    return run_commands(engine, pile_text, commands, nicknames) != run_commands(reference, pile_text, commands, nicknames)
+
+
+def shrink(pile_text, commands, still_fails):
+    """Smallest pile and command list found, by dropping one command or pile line at a time, for which
+    still_fails(pile_text, commands) is true. The title line is never dropped."""
+    commands = list(commands)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(commands)):
+            candidate = commands[:i] + commands[i + 1:]
+            if candidate and still_fails(pile_text, candidate):
+                commands = candidate
+                changed = True
+                break
+        lines = pile_text.split("\n")
+        for i in range(1, len(lines)):
+            candidate = "\n".join(lines[:i] + lines[i + 1:])
+            if still_fails(candidate, commands):
+                pile_text = candidate
+                changed = True
+                break
+    return pile_text, commands
+
+
+def find_divergence(iterations=DIFFERENTIAL_ITERATIONS, seed=0, engine=BossPile, reference=ReferenceBossPile):
+    """A minimal (pile text, commands, nicknames) on which engine and reference disagree, or None."""
+    rng = random.Random(seed)
+    for _ in range(iterations):
+        pile_text, names = random_ladder(rng)
+        commands = random_commands(rng, names)
+        nicknames = random_nicknames(rng, names)
+
+        def still_fails(pile_text, commands, nicknames=nicknames):
+            return diverges(pile_text, commands, engine, reference, nicknames)
+
+        if still_fails(pile_text, commands):
+            return shrink(pile_text, commands, still_fails) + (nicknames,)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare BossPile with the frozen reference on random ladders.")
+    parser.add_argument("--iterations", type=int, default=DIFFERENTIAL_ITERATIONS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    divergence = find_divergence(args.iterations, args.seed)
+    if divergence is None:
+        print(f"No divergence in {args.iterations} command sequences.")
+        return
+    pile_text, commands, nicknames = divergence
+    print("Divergence found. Pile:\n" + pile_text + f"\n\nNicknames: {nicknames}\n\nCommands:")
+    for command in commands:
+        print(command)
+    for engine in [BossPile, ReferenceBossPile]:
+        print(f"\n{engine.__name__}:")
+        for reply, pile in run_commands(engine, pile_text, commands, nicknames):
+            print(reply + "\n" + pile)
+
+
+if __name__ == "__main__":
+    main()
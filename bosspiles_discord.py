@@ -1,9 +1,12 @@
 """Discord client."""
+import asyncio
+import concurrent.futures
+import contextlib
 import datetime as dt
+import functools
 import logging
-from logging.handlers import RotatingFileHandler
 import json
-import re
+import os
 import shlex
 import traceback
 import time
@@ -12,28 +15,124 @@ import datetime
 import discord
 from discord.ext import tasks
 
-from bosspiles import BossPile
+from bosspiles import BossPile, generate_status_checks, is_valid_bosspile, run_pile_command
+from bosspiles_bulk import (BULK_CONCURRENCY, apply_bulk_operation, bulk_operation_name, check_bulk_args,
+                           format_bulk_summary, pile_diff)
+from bosspiles_coordinator import (COORDINATOR_PORT, COORDINATOR_PORT_ENV, SHARD_COUNT_ENV, SHARD_ID_ENV, CoordinatorClient,
+                                   LocalCoordinator)
+from bosspiles_history import ResultHistory, run_stats_query
+from bosspiles_leaderboard import LeaderboardIndex
+from bosspiles_ratings import RatingEngine
+from bosspiles_logging import get_logger
+from bosspiles_members import MemberNameCache
+from bosspiles_metrics import (COMMANDS, COMMAND_LATENCY, COMMAND_ROUND_TRIPS, ERRORS, METRICS_PORT, METRICS_PORT_ENV, PIN_REBASES,
+                               count_rate_limits, monitor_loop_lag, observe_api, serve_metrics)
+from bosspiles_outbound import (OUTBOUND_GLOBAL_INTERVAL, PRIORITY_BULK, PRIORITY_PIN, PRIORITY_REPLY, CommandPlan,
+                                OutboundQueue, batch_messages, iter_message_parts, plan_sends, strip_suffix)
+from bosspiles_responses import RESPONSE_REFRESH_SECONDS, ResponseCache
+from bosspiles_shards import ShardedPin
+from bosspiles_speculation import OutcomeCache
+from bosspiles_versions import PinVersions, pile_changed, stamp_version
 from keys import TOKEN
 
-LOG_FILENAME = "errs"
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
 logging.getLogger("discord").setLevel(logging.WARN)
-# Add the log message handler to the logger
-handler = RotatingFileHandler(LOG_FILENAME, maxBytes=10000000, backupCount=0)
-formatter = logging.Formatter("%(asctime)s | %(name)s | %(levelname)s | %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
+count_rate_limits()
 day_started = str(datetime.date.today())
 
+# Only fetch display names for players on the ladder instead of caching every member of every guild
+LEAN_MEMBER_CACHE = False
+
+# Set by bosspiles_deploy.py when guilds are spread across several processes
+SHARD_ID = int(os.environ.get(SHARD_ID_ENV, 0))
+SHARD_COUNT = int(os.environ.get(SHARD_COUNT_ENV, 1))
 # Intents are required as of discord 1.5
 intents = discord.Intents(messages=True, guilds=True, members=True)
-client = discord.Client(intents=intents)
-
-VALID_COMMANDS = ["new", "win", "edit", "move", "remove", "active", "print", "pin", "unpin"]
+client_options = {"shard_id": SHARD_ID, "shard_count": SHARD_COUNT} if SHARD_COUNT > 1 else {}
+# discord.py waits out shorter rate limits itself. Longer ones raise RateLimited so that the outbound queue
+# holds only that channel and keeps sending to the others (30s is the least discord.py allows)
+client_options["max_ratelimit_timeout"] = 30
+if LEAN_MEMBER_CACHE:
+    client = discord.Client(intents=intents, member_cache_flags=discord.MemberCacheFlags.none(),
+                            chunk_guilds_at_startup=False, **client_options)
+else:
+    client = discord.Client(intents=intents, **client_options)
+# Per-channel command locks and weekly status check claims, shared with the other shards if there are any
+coordinator = LocalCoordinator()
+member_names = MemberNameCache()
+# Precompute every possible `$win` on each channel's pile in the background (not used with LEAN_MEMBER_CACHE)
+SPECULATE_OUTCOMES = False
+outcomes = OutcomeCache()
+
+VALID_COMMANDS = ["new", "win", "edit", "move", "remove", "active", "print", "pin", "unpin", "stats", "games", "bulk"]
 BOSSPILE_SERVER_ID = 419535969507606529
+BOSSPILE_CATEGORY = "bosspile tracking channels"
 SECONDS_PER_WEEK = 7 * 86400
 STATUS_LOCK = '.statuslock'
+# Weekly status checks: how many `!status` commands the BGA bot accepts per message and how they're joined
+STATUS_BATCH_SIZE = 5
+STATUS_SEPARATOR = "\n"
+# Seconds between any two status messages (so we don't DDOS the BGA bot) and between two in one channel.
+# The global budget is shared by every shard, so each one gets its share.
+STATUS_GLOBAL_INTERVAL = 10 * SHARD_COUNT
+STATUS_CHANNEL_INTERVAL = 30
+# Log the status check schedule instead of sending it
+STATUS_DRY_RUN = False
+metrics_server = None
+history = ResultHistory()
+ratings = RatingEngine(history)
+# Every send, edit and pin goes through here so replies and pin edits aren't stuck behind status checks
+# Discord's global rate limit is per bot, so it is split between the shards too
+outbound = OutboundQueue(global_interval=OUTBOUND_GLOBAL_INTERVAL * SHARD_COUNT)
+# Rerun a command on a fresh pin if a newer version of its pile was saved (seen in an edit event) since it was read
+VERIFY_PIN_VERSION = True
+MAX_REBASES = 3
+pin_versions = PinVersions()
+# Guild id => standings of every player in every bosspile channel of that guild
+leaderboards = {}
+HELP_FILENAME = "help_text.md"
+# Sent for `$` if the help file hasn't been loaded
+HELP_FALLBACK = "The help text is unavailable right now. The commands are " + \
+    ", ".join([f"`${command}`" for command in VALID_COMMANDS]) + "."
+# Help and other replies that only change when their file does, split into messages ahead of time
+responses = ResponseCache()
+
+
+# Every history and ratings call runs on this one thread, in the order they were made,
+# so SQLite never blocks the event loop
+history_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+
+
+async def in_history_thread(func, *args):
+    """Run func(*args) on the history thread and return its result."""
+    return await asyncio.get_running_loop().run_in_executor(history_executor, functools.partial(func, *args))
+
+
+def record_in_history_thread(channel_name, events, boss):
+    """Queue a command's results to be recorded without waiting for them."""
+    def record():
+        history.record(channel_name, events, boss=boss)
+        ratings.record(channel_name, events)
+
+    def log_error(recorded):
+        if recorded.exception():
+            ERRORS.inc("history")
+            logger.error("Could not record results for #%s: %s", channel_name, recorded.exception())
+    history_executor.submit(record).add_done_callback(log_error)
+
+
+# Results are recorded in memory and written to the history db in batches
+@tasks.loop(seconds=5)
+async def flush_history():
+    await in_history_thread(history.flush)
+
+
+# Reread static replies whose files changed, in a thread so the event loop never waits on the disk
+@tasks.loop(seconds=RESPONSE_REFRESH_SECONDS)
+async def refresh_responses():
+    reloaded = await asyncio.get_running_loop().run_in_executor(None, responses.refresh)
+    if reloaded:
+        logger.debug("Reloaded responses: %s", reloaded)
 
 
 # Schedule a weekly check of bosspiles
@@ -47,47 +146,79 @@ async def check_bosspiles():
     text_channel_list = []
     for server in client.guilds:
         for channel in server.channels:
-            # If it's a bosspile, but not multibosspile or yucata
             isTextChannel = channel and type(channel) == discord.TextChannel
             if isTextChannel and channel.name == "bugs":
-                await channel.send("Weekly status check has triggered.")
-            inBGACategory = channel.category and channel.category.name.lower() == "bosspile tracking channels"
-            if isTextChannel and inBGACategory:
-                text_channel_list.append(channel)
+                await outbound.send(channel, "Weekly status check has triggered.", PRIORITY_BULK)
+        text_channel_list += tracking_channels(server)
+    # Only one shard checks each channel, even if two were serving its guild
+    year, week, _ = datetime.date.today().isocalendar()
+    text_channel_list = [channel for channel in text_channel_list
+                         if await coordinator.claim(f"status:{channel.id}:{year}-W{week}")]
     sorted_channel_names = sorted([chan.name for chan in text_channel_list])
     num_channels = len(text_channel_list)
-    logger.debug(f"Running status check against {num_channels} channels: {sorted_channel_names}")
+    logger.debug("Running status check against %d channels: %s", num_channels, sorted_channel_names)
+    await run_status_checks(text_channel_list, STATUS_DRY_RUN)
+
+
+def is_tracking_channel(channel):
+    """Whether the channel is a text channel in the bosspile tracking category (so not multibosspile or yucata)."""
+    isTextChannel = channel and type(channel) == discord.TextChannel
+    return bool(isTextChannel and channel.category and channel.category.name.lower() == BOSSPILE_CATEGORY)
+
+
+def tracking_channels(guild):
+    """Text channels in the guild's bosspile tracking category."""
+    return [channel for channel in guild.channels if is_tracking_channel(channel)]
+
+
+def get_leaderboard(guild):
+    if guild.id not in leaderboards:
+        leaderboards[guild.id] = LeaderboardIndex()
+    return leaderboards[guild.id]
+
+
+async def warm_leaderboards():
+    """Read every tracked pile once at startup so `$games` covers channels nobody has used yet.
+    After that the index is only updated from piles the bot parses anyway."""
+    for guild in client.guilds:
+        leaderboard = get_leaderboard(guild)
+        for channel in tracking_channels(guild):
+            if channel.name in leaderboard.channel_keys:
+                continue
+            pins = await observe_api("pins", channel.pins())
+            valid_pin, error = await get_pinned_bosspile(pins)
+            if valid_pin:
+                leaderboard.update(BossPile(channel.name, {}, valid_pin.content))
+
+
+async def run_status_checks(text_channel_list, dry_run=False):
+    """Send batched `!status` commands to every channel, staggered to stay under rate limits.
+    With dry_run, the schedule is printed and logged instead of sent."""
+    channel_messages = []
     for channel in text_channel_list:
-        # Stagger messages so we don't DDOS the BGA bot
-        time.sleep(60)
-        pins = await channel.pins()
+        pins = await observe_api("pins", channel.pins())
         valid_pin, error = await get_pinned_bosspile(pins)
         if error or not valid_pin:
             logger.error(error)
+            ERRORS.inc("check_bosspiles")
             continue
-        await channel.send("__**Weekly BGA game status check**__")
-        nicknames = {}
-        # Get the nicknames from the guild members
-        for user in channel.guild.members:
-            nicknames[str(user.id)] = user
-        status_checks = generate_status_checks(channel.name, nicknames, valid_pin.content)
-        for status_check in status_checks:
-            await channel.send(status_check)
-
-
-def generate_status_checks(channel_name, nicknames, pin_content):
-    game_name = re.sub(r'[^-]?bosspile', "", channel_name).replace('-', '')
-    bosspile = BossPile(channel_name, nicknames, pin_content)
-    matches = bosspile.generate_matches()
-    status_checks = []
-    for match in matches:
-        player_names = []
-        for player in match:
-            username = re.sub(r" *\([^)]*\) *", "", player.username)
-            player_names.append(username)
-        player_text = '" "'.join(player_names)  # space between all players, quote player names
-        status_checks.append(f'!status {game_name} "{player_text}"')
-    return status_checks
+        get_leaderboard(channel.guild).update(BossPile(channel.name, {}, valid_pin.content))
+        status_checks = generate_status_checks(channel.name, {}, valid_pin.content)
+        status_messages = batch_messages(status_checks, STATUS_BATCH_SIZE, STATUS_SEPARATOR)
+        channel_messages.append((channel, ["__**Weekly BGA game status check**__"] + status_messages))
+    schedule = plan_sends(channel_messages, STATUS_GLOBAL_INTERVAL, STATUS_CHANNEL_INTERVAL)
+    logger.debug("Status check will send %d messages over %ds", len(schedule), schedule[-1][0] if schedule else 0)
+    if dry_run:
+        for send_at, channel, status_message in schedule:
+            plan_line = f"+{send_at}s #{channel.name}: {status_message!r}"
+            print(plan_line)
+            logger.debug(plan_line)
+        return schedule
+    # Queued at bulk priority on the same schedule, so commands that come in meanwhile go first
+    started = time.monotonic()
+    await asyncio.gather(*[outbound.send(channel, status_message, PRIORITY_BULK, not_before=started + send_at)
+                           for send_at, channel, status_message in schedule])
+    return schedule
 
 
 class GracefulCoroutineExit(Exception):
@@ -99,13 +230,27 @@ class GracefulCoroutineExit(Exception):
 @client.event
 async def on_ready():
     """Let the user who started the bot know that the connection succeeded."""
-    logger.debug(f'{client.user.name} has connected to Discord, and is active on {len(client.guilds)} servers!')
+    logger.debug('%s has connected to Discord, and is active on %d servers!', client.user.name, len(client.guilds))
     # Create words under bot that say "Listening to !bga"
     listening_to_help = discord.Activity(type=discord.ActivityType.listening, name="$")
+    await start_metrics()
+    await start_coordinator()
+    if not flush_history.is_running():
+        flush_history.start()
+        refresh_responses.start()
+        asyncio.ensure_future(warm_leaderboards())
     await check_bosspiles.start()
     await client.change_presence(activity=listening_to_help)
 
 
+@client.event
+async def on_raw_message_edit(payload):
+    """Note piles saved by other instances, so commands here know their copy is stale."""
+    is_ours = client.user and payload.data.get("author", {}).get("id") == str(client.user.id)
+    if is_ours and "content" in payload.data:
+        pin_versions.see(payload.channel_id, payload.data["content"])
+
+
 @client.event
 async def on_message(message):
     """Listen to messages so that this bot can do something."""
@@ -113,12 +258,63 @@ async def on_message(message):
         return
 
     if message.content.startswith('$'):
+        command = command_name(message.content)
+        COMMANDS.inc(command)
+        started = time.perf_counter()
+        plan = CommandPlan(message.channel, outbound)
+        # `$bulk` takes each channel's lock itself, including this one's
+        channel_lock = coordinator.channel_lock(f"channel:{message.channel.id}") if command != "bulk" else contextlib.nullcontext()
         try:
-            return_message = await run_bosspiles(message)
-            await send_message_partials(message.channel, return_message)
+            async with channel_lock:
+                plan.reply = await run_bosspiles(message, plan)
+                await plan.execute()
         except Exception as e:
-            await message.channel.send("Tell <@!234561564697559041> to fix his bosspiles bot.")
-            logger.error(traceback.format_exc() + str(e))
+            ERRORS.inc("on_message")
+            await outbound.send(message.channel, "Tell <@!234561564697559041> to fix his bosspiles bot.")
+            logger.error("%s%s", traceback.format_exc(), e)
+        COMMAND_LATENCY.observe(time.perf_counter() - started, command)
+        COMMAND_ROUND_TRIPS.observe(plan.round_trips, command)
+        logger.debug("`%s` took %d Discord round trips", command, plan.round_trips)
+
+
+async def start_metrics():
+    """Start the metrics endpoint and event loop lag probe once (on_ready fires again on reconnect)."""
+    global metrics_server
+    if metrics_server is None:
+        port = int(os.environ.get(METRICS_PORT_ENV, METRICS_PORT + SHARD_ID))
+        try:
+            metrics_server = await serve_metrics(port=port)
+        except OSError as e:
+            # The bot works without metrics, so this mustn't stop on_ready from starting everything else
+            ERRORS.inc("metrics")
+            logger.error("Could not serve metrics on port %d: %s", port, e)
+            return
+        asyncio.ensure_future(monitor_loop_lag())
+
+
+async def start_coordinator():
+    """Connect to the deployment's coordinator once if this is one of several shards."""
+    global coordinator
+    if SHARD_COUNT > 1 and isinstance(coordinator, LocalCoordinator):
+        port = int(os.environ.get(COORDINATOR_PORT_ENV, COORDINATOR_PORT))
+        coordinator = CoordinatorClient(port=port)
+        try:
+            await coordinator.connect()
+        except OSError as e:
+            logger.error("Could not connect to the coordinator on port %d: %s", port, e)
+            coordinator.lost_connection()
+
+
+def command_name(msg_text):
+    """Get the full subcommand name from a message for use as a metric label."""
+    words = msg_text.lstrip('$').split(maxsplit=1)
+    if not words or words[0][0] == 'h':
+        return "help"
+    prefix = words[0].lower()
+    for cmd in VALID_COMMANDS:
+        if cmd.startswith(prefix):
+            return cmd
+    return "unrecognized"
 
 
 async def parse_args(msg_text):
@@ -136,65 +332,46 @@ async def parse_args(msg_text):
         return [], "`$pin` requires one argument: the message ID (number) of the message you want to pin."
     elif ("edit".startswith(args[0]) or "active".startswith(args[0])) and len(args) != 3:
         return [], f"`${args[0]}` requires 2 arguments. See `$`."
+    elif "stats".startswith(args[0]) and len(args) < 3:
+        return [], "`$stats` requires a query and a player, like `$stats record Pocc`. See `$`."
+    elif "games".startswith(args[0]) and len(args) < 2:
+        return [], "`$games` requires a player, like `$games Pocc`. See `$`."
+    elif "bulk".startswith(args[0]) and len(args) < 2:
+        return [], check_bulk_args(None, [])
     elif not any([cmd.startswith(args[0]) for cmd in VALID_COMMANDS]):
         return [], f"`${args[0]}` is not a recognized subcommand. See `$`."
     else:
         return args, ""
 
 
-def is_valid_bosspile(pin_text):
-    if '\n' not in pin_text:
-        return False
-    first_line = pin_text.lower().split('\n')[0]
-    has_crown = "\n:crown:" in pin_text or "\n👑" in pin_text
-    has_title = 'bosspile' in first_line or 'ladder' in first_line
-    has_winners = ":small_orange_diamond:" in pin_text or "🔸" in pin_text
-    has_climbers = "arrow_double_up" in pin_text or "⏫" in pin_text
-    return has_crown and has_title and (has_winners or has_climbers)
-
-
 async def get_pinned_bosspile(pins):
-    """Get the pinned messages if there are any."""
+    """Get the pinned bosspile (as a ShardedPin, which may span several of this bot's pins) if there is one."""
     if len(pins) == 0:
         return None, "This channel has no pins (a pinned bosspile is required)"
     for pin in pins:
         # First try to get pins by this bot before other messages
         if pin.author.id == client.user.id:
-            return pin, ""
+            bot_pile = ShardedPin.from_bot_pins([bot_pin for bot_pin in pins if bot_pin.author.id == client.user.id])
+            if bot_pile:
+                return bot_pile, ""
         # If it has the format of a bosspile, treat it like one
         elif is_valid_bosspile(pin.content):
-            return pin, ""
+            return ShardedPin([pin]), ""
     return None, "This channel has no bosspile pins! Pin your bosspile message and try again."
 
 
 async def execute_command(args, bosspile):
     """Execute the $ command the user has entered and return a message."""
     args[0] = args[0].lower()
-    if "win".startswith(args[0]):
-        victor = ' '.join(args[1:])
-        return bosspile.win(victor)
-    elif "new".startswith(args[0]):
-        player_name = ' '.join(args[1:])
-        return bosspile.add(player_name)
-    elif "edit".startswith(args[0]):
-        old_line = args[1]
-        new_line = args[2]
-        return bosspile.edit(old_line, new_line)
-    elif "move".startswith(args[0]):
-        player = ' '.join(args[1:-1])
-        relative_position = args[-1]
-        return bosspile.move(player, relative_position)
-    elif "remove".startswith(args[0]):
-        player_name = ' '.join(args[1:])
-        return bosspile.remove(player_name)
-    elif "active".startswith(args[0]):
-        player_name = ' '.join(args[1:-1])
-        state = args[-1].lower().startswith("t")  # t for true, anything else is false
-        return bosspile.change_active_status(player_name, state)
-    elif "print".startswith(args[0]):
+    reply = run_pile_command(bosspile, args)
+    if reply is not None:
+        return reply
+    if "print".startswith(args[0]):
         if len(args) > 1:
             if args[1].startswith("d"):  # debug
-                return "\n".join([json.dumps(p.__dict__) for p in bosspile.players])
+                return "\n".join([json.dumps(p.fields()) for p in bosspile.players])
+            elif args[1].startswith("rat"):  # ratings
+                return await in_history_thread(ratings.view, bosspile.channel_name, bosspile)
             elif args[1].startswith("r"):  # raw
                 return f"`{bosspile.generate_bosspile()}`"
         return bosspile.generate_bosspile()
@@ -202,38 +379,55 @@ async def execute_command(args, bosspile):
         return f"Unrecognized command {args[0]}. Run `$`."
 
 
-async def run_bosspiles(message):
-    """Run the bosspiles program ~ main()."""
-    logger.debug(f"Received message `{message.content}`")
+async def run_bosspiles(message, plan):
+    """Run the bosspiles program ~ main(). Pin changes are added to the plan; the reply is returned."""
+    logger.debug("Received message in #%s (%s) `%s`", getattr(message.channel, "name", "DM"),
+                 message.guild.id if message.guild else "DM", message.content)
     # if this is a discord server and the channel is a specific one
     if message.guild and message.guild.id == BOSSPILE_SERVER_ID and "mbosspile" in message.channel.name:
         return "@Coxy5 manages this bosspile, not the bosspiles bot. He is quite helpful and will get you sorted right quick."
     args, errs = await parse_args(message.content)
     if errs:
+        plan.reply_parts = responses.parts_for(errs)  # The help text is already split into messages
         return errs
+    if "stats".startswith(args[0]):  # Answered from history, so no need for the pin
+        return await in_history_thread(run_stats_query, history, message.channel.name, args)
+    if "games".startswith(args[0]):  # Answered from the guild's leaderboard index
+        return get_leaderboard(message.guild).view(' '.join(args[1:]))
+    if "bulk".startswith(args[0]):  # Works on every pile in the guild, not this channel's
+        if not is_admin(message.author):
+            return "You don't have permissions to change every bosspile."
+        return await run_bulk_operation(message.guild, args[1:])
     nicknames = {}
-    # Get the nicknames from the guild members
-    for user in message.guild.members:
-        nicknames[str(user.id)] = user.display_name
+    if not LEAN_MEMBER_CACHE:
+        # Get the nicknames from the guild members
+        for user in message.guild.members:
+            nicknames[str(user.id)] = user.display_name
     # We can change the board game name, but I'm not sure it matters.
-    channel_pins = await message.channel.pins()
+    channel_pins = await observe_api("pins", message.channel.pins())
+    plan.count_calls()
     if args[0] == "unpin":
         # Unpin requires a reason
         if len(args) < 2:
-            await message.author.send("You need to provide a reason for the unpin (1+ words).")
-        elif message.author.id == 234561564697559041 or message.author.guild_permissions.administrator:
-            await unpin_bot_pins(args, message)
+            await outbound.send(message.author, "You need to provide a reason for the unpin (1+ words).")
+            plan.count_calls()
+        elif is_admin(message.author):
+            await unpin_bot_pins(args, channel_pins, plan)
         else:
-            await message.author.send("You don't have permissions to unpin.")
+            await outbound.send(message.author, "You don't have permissions to unpin.")
+            plan.count_calls()
         return ""
     elif args[0] == "pin":
         for pin in channel_pins:
             if pin.author.id == client.user.id:
                 return "`$pin` can be used when this bot has no pins on the channel. There is already a bosspile pinned by this bot."
-        msg_to_pin = await message.channel.fetch_message(args[1])
+        msg_to_pin = await observe_api("fetch_message", message.channel.fetch_message(args[1]))
+        plan.count_calls()
         if is_valid_bosspile(msg_to_pin.content):
-            new_bp_pin = await message.channel.send(msg_to_pin.content)
-            await new_bp_pin.pin()
+            version = pin_versions.next_version(message.channel.id, msg_to_pin.content)
+            new_bosspile = stamp_version(msg_to_pin.content, version)
+            plan.replace_pin(new_bosspile)
+            plan.on_saved.append(functools.partial(pin_versions.see, message.channel.id, new_bosspile))
             return f"Pinned {args[1]} successfully!"
         else:
             return f"Message with ID {args[1]} is not a valid bosspile. Make sure it has a\
@@ -245,12 +439,36 @@ async def run_bosspiles(message):
         return errs
     # We can only edit our own messages
     edit_existing_bp = bp_pin.author == client.user
-    bosspile = BossPile(message.channel.name, nicknames, bp_pin.content)
-    return_message = await execute_command(args, bosspile)
-    new_bosspile = bosspile.generate_bosspile()
+    is_win = "win".startswith(args[0].lower())
+    speculate = SPECULATE_OUTCOMES and not LEAN_MEMBER_CACHE
+    bosspile, return_message, new_bosspile = await apply_command(message, args, nicknames, bp_pin, speculate)
     contributors_line, day_expires = generate_contrib_line()
+    # Another instance may have saved the pile since it was read. The pins are only fetched again if so.
+    pin_versions.see(message.channel.id, bp_pin.content)
+    for rebases in range(MAX_REBASES + 1):
+        saving = pile_changed(strip_suffix(bp_pin.content, contributors_line), new_bosspile)
+        stale = pin_versions.is_stale(message.channel.id, bp_pin.content)
+        if not (VERIFY_PIN_VERSION and edit_existing_bp and saving and stale):
+            break
+        if rebases == MAX_REBASES:
+            return "The bosspile kept changing while this command ran. No changes made, please try again."
+        fresh_pin, errs = await get_pinned_bosspile(await observe_api("pins", message.channel.pins()))
+        plan.count_calls()
+        if errs or fresh_pin.author != client.user:
+            return errs or "The bosspile was replaced while this command ran. No changes made, please try again."
+        PIN_REBASES.inc()
+        logger.debug("Rerunning `%s` in #%s on a pin that changed since it was read", message.content, message.channel.name)
+        bp_pin = fresh_pin
+        pin_versions.reset(message.channel.id, bp_pin.content)
+        bosspile, return_message, new_bosspile = await apply_command(message, args, nicknames, bp_pin, speculate)
+
+    def record_results(bosspile=bosspile):
+        """Only count the command's results once its pile has been saved."""
+        if is_tracking_channel(message.channel):
+            get_leaderboard(message.guild).update(bosspile)
+        record_in_history_thread(message.channel.name, bosspile.events, bosspile.boss())
+    plan.on_saved.append(record_results)
 
-    is_win = args[0].startswith("w")
     # Bosspile Standings or Ladder Standings in title
     is_bosspile_msg = ("standings" in return_message.lower() or "bosspile" in return_message.lower())
     is_bosspile_server = message.guild.id == BOSSPILE_SERVER_ID
@@ -258,16 +476,86 @@ async def run_bosspiles(message):
     if is_win and is_bosspile_msg and is_bosspile_server and is_within_3weeks:
         return_message += contributors_line
         new_bosspile += contributors_line
-    if new_bosspile != bp_pin.content:
+    if pile_changed(strip_suffix(bp_pin.content, contributors_line), strip_suffix(new_bosspile, contributors_line)):
+        new_bosspile = stamp_version(new_bosspile, pin_versions.next_version(message.channel.id, bp_pin.content))
+        plan.on_saved.append(functools.partial(pin_versions.see, message.channel.id, new_bosspile))
         if edit_existing_bp:
-            await bp_pin.edit(content=new_bosspile)
+            plan.edit_pin(bp_pin, new_bosspile, ignored_suffix=contributors_line)
         else:
-            new_msg = await message.channel.send(new_bosspile)
-            await new_msg.pin()
-            await message.channel.send("Created new bosspile pin because this bot can only edit its own messages.")
+            plan.replace_pin(new_bosspile, "Created new bosspile pin because this bot can only edit its own messages.")
+    if speculate:
+        outcomes.refresh(message.channel.name, nicknames, new_bosspile)
     return return_message
 
 
+async def apply_command(message, args, nicknames, bp_pin, speculate):
+    """Run a command on the pile in bp_pin. Returns (BossPile, reply, new pile text)."""
+    if speculate and "win".startswith(args[0].lower()):
+        outcome = outcomes.take(message.channel.name, bp_pin.content, nicknames, ' '.join(args[1:]))
+        if outcome:
+            return outcome
+    bosspile = BossPile(message.channel.name, nicknames, bp_pin.content)
+    if LEAN_MEMBER_CACHE:
+        player_names = [player.name for player in bosspile.players]
+        bosspile.nicknames = await member_names.resolve(message.guild, player_names)
+    return_message = await execute_command(args, bosspile)
+    return bosspile, return_message, bosspile.generate_bosspile()
+
+
+def is_admin(member):
+    return member.id == 234561564697559041 or member.guild_permissions.administrator
+
+
+async def run_bulk_operation(guild, bulk_args):
+    """Apply `rename|remove|inactive <player> [new name] [confirm]` to every tracked pile in the guild,
+    a few channels at a time. Without `confirm` nothing is saved and the summary is a dry run."""
+    dry_run = bulk_args[-1].lower() != "confirm"
+    if not dry_run:
+        bulk_args = bulk_args[:-1]
+    operation = bulk_operation_name(bulk_args[0]) if bulk_args else None
+    errs = check_bulk_args(operation, bulk_args[1:])
+    if errs:
+        return errs
+    player = bulk_args[1]
+    new_name = bulk_args[2] if operation == "rename" else ""
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def update_channel(channel):
+        """(channel name, reply, diff, error). One channel failing is reported with the rest instead of
+        aborting the summary while the other channels are still being saved."""
+        try:
+            async with semaphore, coordinator.channel_lock(f"channel:{channel.id}"):
+                pins = await observe_api("pins", channel.pins())
+                pile_pin, errs = await get_pinned_bosspile(pins)
+                if errs:
+                    return channel.name, None, [], errs
+                bosspile = BossPile(channel.name, {}, pile_pin.content)
+                old_bosspile = bosspile.generate_bosspile()
+                reply = apply_bulk_operation(bosspile, operation, player, new_name)
+                new_bosspile = bosspile.generate_bosspile()
+                diff = pile_diff(old_bosspile, new_bosspile) if reply is not None else []
+                if not dry_run and diff:
+                    new_bosspile = stamp_version(new_bosspile, pin_versions.next_version(channel.id, pile_pin.content))
+                    plan = CommandPlan(channel, outbound)
+                    if pile_pin.author == client.user:
+                        plan.edit_pin(pile_pin, new_bosspile)
+                    else:
+                        plan.replace_pin(new_bosspile)
+                    await plan.execute()
+                    pin_versions.see(channel.id, new_bosspile)
+                    get_leaderboard(guild).update(bosspile)
+                    record_in_history_thread(channel.name, bosspile.events, bosspile.boss())
+                return channel.name, reply, diff, None
+        except Exception as e:
+            ERRORS.inc("bulk")
+            logger.error("Bulk %s failed in #%s: %s%s", operation, channel.name, traceback.format_exc(), e)
+            return channel.name, None, [], f"{type(e).__name__}: {e}"
+
+    results = await asyncio.gather(*[update_channel(channel) for channel in tracking_channels(guild)])
+    return format_bulk_summary(operation, player, results, dry_run)
+
+
+@functools.lru_cache(maxsize=None)  # Only changes when the contributions do
 def generate_contrib_line():
     contributions = {
         "Coxy5": 15,
@@ -286,14 +574,14 @@ def generate_contrib_line():
     return f"\n_Hosting paid for until {isodate_expires} thanks to [{contributor_line}]._", day_expires
 
 
-async def unpin_bot_pins(args, message):
-    """Unpin all of the bot's pins."""
-    bot_pins = await message.channel.pins()
-    for pin in bot_pins:
+async def unpin_bot_pins(args, channel_pins, plan):
+    """Unpin all of the bot's pins. Each pin's content is posted before it is unpinned, so if the post fails
+    the pin stays put instead of being lost."""
+    for pin in channel_pins:
         if pin.author == client.user:  # If this bot created it
-            await message.channel.send("Bosspile being unpinned:")
-            await message.channel.send(pin.content)
-            await pin.unpin(reason=' '.join(args[1:]))
+            for msg_part in iter_message_parts("Bosspile being unpinned:\n" + pin.content):
+                await plan.call(PRIORITY_PIN, "send", lambda msg_part=msg_part: plan.channel.send(msg_part))
+            await plan.call(PRIORITY_PIN, "unpin", lambda pin=pin: pin.unpin(reason=' '.join(args[1:])))
     return "Bosspile unpinned successfully!"
 
 
@@ -306,36 +594,18 @@ async def send_table_embed(message, game, active_players, inactive_players):
     retmsg.add_field(name="Active", value=active_players, inline=False)
     retmsg.add_field(name="Inactive", value=inactive_players, inline=False)
     retmsg.set_author(name=message.author.display_name, icon_url=message.author.avatar_url)
-    await message.channel.send(embed=retmsg)
+    await outbound.submit(message.channel, PRIORITY_REPLY, "send", lambda: message.channel.send(embed=retmsg))
+
+
+def compact_help(help_msg):
+    return help_msg.replace(4 * " ", "\t")  # 2000 chars adds up quick
 
 
 def get_help():
-    with open("help_text.md") as f:
-        help_msg = f.read()
-    truncated_help_msg = help_msg.replace(4 * " ", "\t")  # 2000 chars adds up quick
-    return truncated_help_msg
-
-
-async def send_message_partials(destination, remainder):
-    # Loop over text and send message parts from the remainder until remainder is no more
-    while len(remainder) > 0:
-        chars_per_msg = 2000
-        if len(remainder) < chars_per_msg:
-            chars_per_msg = len(remainder)
-        msg_part = remainder[:chars_per_msg]
-        remainder = remainder[chars_per_msg:]
-        # Only break on newline
-        if len(remainder) > 0:
-            while remainder[0] != "\n":
-                remainder = msg_part[-1] + remainder
-                msg_part = msg_part[:-1]
-            # Discord will delete whitespace before a message
-            # so preserve that whitespace by inserting a character
-            while remainder[0] == "\n":
-                remainder = remainder[1:]
-            if remainder[0] == "\t":
-                remainder = ".   " + remainder[1:]
-        await destination.send(msg_part)
-
-
-client.run(TOKEN)
+    return responses.text("help")
+
+
+responses.register("help", HELP_FILENAME, compact_help, HELP_FALLBACK)
+
+if __name__ == "__main__":
+    client.run(TOKEN)
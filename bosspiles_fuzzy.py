@@ -0,0 +1,117 @@
+"""Approximate player name lookups with a deletion-neighbourhood index over player keys.
+
+Two strings within edit distance d always share a string that both reach by deleting at most d
+characters. Indexing every key under its deletions means a lookup is a few dict probes for the
+query's deletions plus an exact check of the handful of candidates, regardless of ladder size.
+
+Indexes are kept per channel and updated with the keys that joined or left since the last lookup,
+so wins and moves, which only reorder the ladder, don't rebuild anything."""
+
+FUZZY_MAX_DISTANCE = 2
+INDEX_CACHE_SIZE = 64
+
+_index_cache = {}
+
+
+def edit_distance(left, right, max_distance):
+    """Levenshtein distance between two strings, or max_distance + 1 once it's known to be larger."""
+    if abs(len(left) - len(right)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(right) + 1))
+    for i, left_char in enumerate(left, 1):
+        current = [i]
+        for j, right_char in enumerate(right, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (left_char != right_char)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def deletions(key, max_deletions):
+    """key and every string made by deleting up to max_deletions characters from it."""
+    found = {key}
+    frontier = {key}
+    for _ in range(max_deletions):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        found |= frontier
+    return found
+
+
+class DeletionIndex:
+    """Index from every deletion variant of a key to the keys it came from."""
+    def __init__(self, keys=(), max_distance=FUZZY_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.keys = set()
+        self.variants = {}
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        for variant in deletions(key, self.max_distance):
+            self.variants.setdefault(variant, set()).add(key)
+
+    def remove(self, key):
+        if key not in self.keys:
+            return
+        self.keys.discard(key)
+        for variant in deletions(key, self.max_distance):
+            variant_keys = self.variants[variant]
+            variant_keys.discard(key)
+            if not variant_keys:
+                del self.variants[variant]
+
+    def update(self, keys):
+        """Make the indexed keys exactly these, only indexing the ones that changed."""
+        keys = set(keys)
+        for key in self.keys - keys:
+            self.remove(key)
+        for key in keys - self.keys:
+            self.add(key)
+
+    def search(self, key, max_distance):
+        """[(distance, key)] for every key within max_distance, closest first."""
+        max_distance = min(max_distance, self.max_distance)
+        candidates = set()
+        for variant in deletions(key, max_distance):
+            candidates |= self.variants.get(variant, set())
+        found = []
+        for candidate in candidates:
+            distance = edit_distance(key, candidate, max_distance)
+            if distance <= max_distance:
+                found.append((distance, candidate))
+        found.sort()
+        return found
+
+    def closest(self, key, max_distance=FUZZY_MAX_DISTANCE):
+        """Keys at the smallest edit distance from key, if any are within max_distance."""
+        # Short names would match almost anything, so allow about one edit per 3 characters
+        max_distance = min(max_distance, len(key) // 3)
+        if max_distance == 0:
+            return []
+        matches = self.search(key, max_distance)
+        return [match_key for distance, match_key in matches if distance == matches[0][0]]
+
+
+def get_index(keys, owner=None):
+    """The index for owner (usually a channel), brought up to date with keys.
+    Without an owner, indexes are shared between callers with the same set of keys.
+    The INDEX_CACHE_SIZE most recently used indexes are kept."""
+    cache_key = owner if owner is not None else frozenset(keys)
+    index = _index_cache.pop(cache_key, None)
+    if index is None:
+        index = DeletionIndex(keys)
+        if len(_index_cache) >= INDEX_CACHE_SIZE:
+            _index_cache.pop(next(iter(_index_cache)))
+    elif owner is not None:
+        index.update(keys)
+    _index_cache[cache_key] = index  # Most recently used last
+    return index
+
+
+def closest_keys(keys, key, max_distance=FUZZY_MAX_DISTANCE, owner=None):
+    """Keys at the smallest edit distance from key, if any are within max_distance."""
+    return get_index(keys, owner).closest(key, max_distance)
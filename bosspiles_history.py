@@ -0,0 +1,166 @@
+"""SQLite history of every change applied to a bosspile.
+
+Recording only appends to a pending list; rows are written in one transaction by flush(),
+which the bot calls periodically and which every query calls first. The bot makes all of these calls
+from one worker thread so the event loop never waits on the disk."""
+import datetime as dt
+import sqlite3
+import time
+
+from bosspiles import PileEvent, player_key
+
+HISTORY_DB = 'history.db'
+FLUSH_BATCH_SIZE = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    time REAL NOT NULL,
+    command TEXT NOT NULL,
+    player TEXT NOT NULL,
+    player_key TEXT NOT NULL,
+    detail TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS result_players (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    player_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_channel_time ON results(channel, command, time);
+CREATE INDEX IF NOT EXISTS results_player ON results(player_key, command, channel);
+CREATE INDEX IF NOT EXISTS result_players_player ON result_players(player_key, result_id);
+"""
+
+
+class ResultHistory:
+    """Store of every win, crown, diamond, add, remove and active change by channel, player and time."""
+    def __init__(self, db_path=HISTORY_DB):
+        # Opened on the event loop's thread but used from the bot's history thread
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.pending = []
+        self.bosses = {}  # channel => player_key of the last recorded boss
+
+    def record(self, channel, events, when=None, boss=None):
+        """Queue a command's PileEvents to be written on the next flush.
+        boss is who holds the crown after the command. A boss event is added when that isn't who the history
+        last had, so boss changes from active, move and remove (and the first boss seen) are kept too."""
+        when = when or time.time()
+        for event in events:
+            self.pending.append((channel, when, event))
+            if event.command == "crown":
+                self.bosses[channel] = player_key(event.player)
+        if boss is not None and player_key(boss) != self.last_boss(channel):
+            self.pending.append((channel, when, PileEvent("boss", boss)))
+            self.bosses[channel] = player_key(boss)
+        if len(self.pending) >= FLUSH_BATCH_SIZE:
+            self.flush()
+
+    def last_boss(self, channel):
+        """player_key of the last recorded boss in this channel, or None."""
+        if channel not in self.bosses:
+            self.flush()
+            row = self.db.execute("""SELECT player_key FROM results WHERE channel = ? AND command IN ('crown', 'boss')
+                                  ORDER BY time DESC, id DESC LIMIT 1""", (channel,)).fetchone()
+            self.bosses[channel] = row[0] if row else None
+        return self.bosses[channel]
+
+    def flush(self):
+        """Write all pending events in one transaction."""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        with self.db:
+            for channel, when, event in pending:
+                cursor = self.db.execute(
+                    "INSERT INTO results (channel, time, command, player, player_key, detail) VALUES (?, ?, ?, ?, ?, ?)",
+                    (channel, when, event.command, event.player, player_key(event.player), event.detail))
+                self.db.executemany("INSERT INTO result_players (result_id, player_key) VALUES (?, ?)",
+                                    [(cursor.lastrowid, player_key(other)) for other in event.others])
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def head_to_head(self, channel, player, opponent):
+        """Number of times player has beaten opponent in this channel."""
+        self.flush()
+        return self.db.execute(
+            """SELECT count(*) FROM result_players rp JOIN results r ON r.id = rp.result_id
+            WHERE rp.player_key = ? AND r.player_key = ? AND r.command = 'win' AND r.channel = ?""",
+            (player_key(opponent), player_key(player), channel)).fetchone()[0]
+
+    def win_loss(self, channel, player):
+        """(wins, losses) for a player in this channel."""
+        self.flush()
+        key = player_key(player)
+        wins = self.db.execute("SELECT count(*) FROM results WHERE player_key = ? AND command = 'win' AND channel = ?",
+                               (key, channel)).fetchone()[0]
+        losses = self.db.execute(
+            """SELECT count(*) FROM result_players rp JOIN results r ON r.id = rp.result_id
+            WHERE rp.player_key = ? AND r.command = 'win' AND r.channel = ?""", (key, channel)).fetchone()[0]
+        return wins, losses
+
+    def win_results(self, channel):
+        """[(winner key, [loser keys])] for every win in this channel, oldest first."""
+        self.flush()
+        rows = self.db.execute(
+            """SELECT r.player_key, group_concat(rp.player_key, char(31)) FROM results r
+            LEFT JOIN result_players rp ON rp.result_id = r.id
+            WHERE r.channel = ? AND r.command = 'win' GROUP BY r.id ORDER BY r.time, r.id""", (channel,))
+        return [(winner, losers.split("\x1f") if losers else []) for winner, losers in rows]
+
+    def boss_tenures(self, channel, player, now=None):
+        """[(start time, seconds as boss)] for each time the player became boss in this channel,
+        whether by taking the crown or by the pile changing under it."""
+        self.flush()
+        now = now or time.time()
+        rows = self.db.execute(
+            """SELECT player_key, time, LEAD(time) OVER (ORDER BY time, id) FROM results
+            WHERE channel = ? AND command IN ('crown', 'boss')""", (channel,)).fetchall()
+        key = player_key(player)
+        return [(start, (end or now) - start) for boss_key, start, end in rows if boss_key == key]
+
+    def diamonds(self, channel, player):
+        """[(time, 'orange'|'blue')] for each diamond the player has gained in this channel."""
+        self.flush()
+        return self.db.execute(
+            "SELECT time, detail FROM results WHERE player_key = ? AND command = 'diamond' AND channel = ? ORDER BY time",
+            (player_key(player), channel)).fetchall()
+
+
+def format_days(seconds):
+    return f"{seconds / 86400:.1f} days"
+
+
+def run_stats_query(history, channel, args):
+    """Answer `$stats <h2h|record|boss|diamonds> <player> [opponent]` from the history."""
+    query = args[1].lower()
+    player = args[2]
+    if query.startswith("h") and len(args) > 3:
+        opponent = ' '.join(args[3:])
+        player_wins = history.head_to_head(channel, player, opponent)
+        opponent_wins = history.head_to_head(channel, opponent, player)
+        return f"{player} has beaten {opponent} {player_wins} times and lost to them {opponent_wins} times."
+    player = ' '.join(args[2:])
+    if query.startswith("r"):
+        wins, losses = history.win_loss(channel, player)
+        return f"{player} has {wins} wins and {losses} losses."
+    elif query.startswith("b"):
+        tenures = history.boss_tenures(channel, player)
+        if not tenures:
+            return f"{player} has not held the :crown: yet."
+        lines = [f"{player} has held the :crown: {len(tenures)} times for {format_days(sum(t for _, t in tenures))}:"]
+        for start, seconds in tenures:
+            lines.append(f"{dt.date.fromtimestamp(start).isoformat()} for {format_days(seconds)}")
+        return "\n".join(lines)
+    elif query.startswith("d"):
+        diamonds = history.diamonds(channel, player)
+        orange = sum(color == "orange" for _, color in diamonds)
+        blue = len(diamonds) - orange
+        lines = [f"{player} has gained {orange} :small_orange_diamond: and {blue} :large_blue_diamond:"]
+        for when, color in diamonds:
+            symbol = ":small_orange_diamond:" if color == "orange" else ":large_blue_diamond:"
+            lines.append(f"{dt.date.fromtimestamp(when).isoformat()} {symbol}")
+        return "\n".join(lines)
+    return "`$stats` takes `h2h <player> <opponent>`, `record <player>`, `boss <player>` or `diamonds <player>`."
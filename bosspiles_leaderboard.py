@@ -0,0 +1,79 @@
+"""Index of every player's standing in every bosspile channel of a guild, for cross-game queries.
+
+Each channel's entries are replaced whenever the bot parses that channel's pile, so a query is one
+dict lookup instead of a pin fetch per channel."""
+from bosspiles import player_key
+from bosspiles_fuzzy import DeletionIndex
+
+
+class Standing:
+    """One player's place in one pile."""
+    def __init__(self, channel, game, rank, num_players, orange_diamonds, blue_diamonds, active, boss=False):
+        self.channel = channel
+        self.game = game
+        self.rank = rank
+        self.num_players = num_players
+        self.orange_diamonds = orange_diamonds
+        self.blue_diamonds = blue_diamonds
+        self.active = active
+        self.boss = boss
+
+
+class LeaderboardIndex:
+    """player_key => {channel: Standing}, plus the keys in each channel so a channel can be replaced
+    and a fuzzy index of every player key that is kept up to date as players join and leave."""
+    def __init__(self):
+        self.standings = {}
+        self.channel_keys = {}
+        self.usernames = {}
+        self.fuzzy = DeletionIndex()
+
+    def update(self, bosspile):
+        """Replace a channel's standings with those in its current pile."""
+        channel = bosspile.channel_name
+        for key in self.channel_keys.pop(channel, ()):
+            self.standings[key].pop(channel, None)
+            if not self.standings[key]:
+                del self.standings[key]
+                del self.usernames[key]
+                self.fuzzy.remove(key)
+        players = [player for player in bosspile.players if '**' in player.username or '__' not in player.username]
+        boss = next((player for player in players if player.active), None)
+        keys = set()
+        for rank, player in enumerate(players, 1):
+            key = player.key
+            keys.add(key)
+            self.usernames[key] = player.name.strip()  # The latest spelling
+            self.fuzzy.add(key)
+            self.standings.setdefault(key, {})[channel] = Standing(channel, bosspile.game, rank, len(players),
+                                                                   player.orange_diamonds, player.blue_diamonds,
+                                                                   player.active, player is boss)
+        self.channel_keys[channel] = keys
+
+    def lookup(self, player):
+        """(player key, [Standing] best rank first), or (None, error) if the player isn't on any pile."""
+        key = player_key(player)
+        if key not in self.standings:
+            close_keys = self.fuzzy.closest(key)
+            if len(close_keys) != 1:
+                suggestions = " or ".join([f"`{self.usernames[close_key]}`" for close_key in close_keys])
+                return None, f"{player} is not on any bosspile." + (f" Did you mean {suggestions}?" if suggestions else "")
+            key = close_keys[0]
+        standings = sorted(self.standings[key].values(), key=lambda standing: (standing.rank, standing.game))
+        return key, standings
+
+    def view(self, player):
+        """Text for `$games <player>`: rank, diamonds and active state in every pile."""
+        key, standings = self.lookup(player)
+        if key is None:
+            return standings
+        lines = [f"__**{self.usernames[key]} across {len(standings)} bosspiles**__"]
+        for standing in standings:
+            line = f"{standing.game}: {':crown:' if standing.boss else '#' + str(standing.rank)} of {standing.num_players}"
+            line += standing.blue_diamonds * " :large_blue_diamond:"
+            line += (standing.orange_diamonds // 5) * " :large_orange_diamond:"
+            line += (standing.orange_diamonds % 5) * " :small_orange_diamond:"
+            if not standing.active:
+                line += " :timer:"
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,82 @@
+"""Shared, non-blocking logging for the bosspiles modules.
+
+Every module logs through a QueueHandler so that the caller (usually the event loop)
+only appends a record to a queue. One background QueueListener owns the single
+RotatingFileHandler on LOG_FILENAME, formats the records and writes them to disk."""
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+
+# Shard processes each log to their own file
+LOG_FILENAME_ENV = "BOSSPILES_LOG"
+LOG_FILENAME = os.environ.get(LOG_FILENAME_ENV, 'errs')
+LOG_FORMAT = "%(asctime)s | %(name)s | %(levelname)s | %(message)s"
+LOG_MAX_BYTES = 10000000
+
+_log_queue = queue.SimpleQueue()
+_queue_handler = None
+_listener = None
+
+
+class LazyQueueHandler(QueueHandler):
+    """Enqueue records without formatting them.
+    The stock QueueHandler formats in the caller so records can be pickled;
+    ours never leave the process, so formatting is left to the listener thread."""
+    def prepare(self, record):
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Only let through one of every `every` records for each chatty message template.
+    Records are matched on their unformatted msg, so lazy %-style calls are sampled per call site."""
+    def __init__(self, every, templates):
+        super().__init__()
+        self.every = max(1, every)
+        self.templates = set(templates)
+        self.counts = {}
+
+    def filter(self, record):
+        if record.msg not in self.templates:
+            return True
+        count = self.counts.get(record.msg, 0)
+        self.counts[record.msg] = count + 1
+        return count % self.every == 0
+
+
+def start_listener():
+    """Start the background writer if it isn't running. Safe to call more than once."""
+    global _queue_handler, _listener
+    if _listener is not None:
+        return _queue_handler
+    file_handler = RotatingFileHandler(LOG_FILENAME, maxBytes=LOG_MAX_BYTES, backupCount=0, delay=True)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _queue_handler = LazyQueueHandler(_log_queue)
+    _listener = QueueListener(_log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_listener)
+    return _queue_handler
+
+
+def stop_listener():
+    """Flush everything still queued to disk and stop the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def get_logger(name, sample_every=1, sampled_templates=()):
+    """Get a DEBUG logger that writes through the shared queue.
+    Messages in `sampled_templates` are only logged once every `sample_every` calls."""
+    logger = logging.getLogger(name)
+    queue_handler = start_listener()
+    if queue_handler not in logger.handlers:
+        logger.addHandler(queue_handler)
+    if sample_every > 1 and sampled_templates:
+        logger.addFilter(SamplingFilter(sample_every, sampled_templates))
+    logger.setLevel(logging.DEBUG)
+    return logger
@@ -0,0 +1,67 @@
+"""Display names for just the players on a ladder, for guilds too big to cache every member.
+
+In lean mode the client keeps no member cache. Names are fetched on demand with
+guild.query_members, a few at a time, and kept for MEMBER_NAME_TTL seconds.
+Expired names are dropped by resolve at most once per TTL, so the cache only holds recent ladders.
+bosspiles_memory.py compares its memory use with the full member cache."""
+import asyncio
+import time
+
+from bosspiles_metrics import observe_api, record_cache
+
+MEMBER_NAME_TTL = 15 * 60
+# Concurrent query_members requests per resolve, so a big ladder doesn't flood the gateway
+MEMBER_QUERY_CHUNK = 10
+MEMBER_QUERY_LIMIT = 5
+
+
+class MemberNameCache:
+    """(guild id, lowercased name) => {user id: display name} of members matching that name, with a TTL.
+    Names that match nobody are cached too so they aren't queried on every command."""
+    def __init__(self, ttl=MEMBER_NAME_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.next_prune = 0
+
+    def get(self, guild_id, name, now):
+        entry = self.entries.get((guild_id, name.lower()))
+        if entry is None or entry[0] < now:
+            record_cache("member_names", False)
+            return None
+        record_cache("member_names", True)
+        return entry[1]
+
+    def put(self, guild_id, name, members, now):
+        self.entries[(guild_id, name.lower())] = (now + self.ttl, members)
+
+    def prune(self, now):
+        """Drop expired names."""
+        self.entries = {key: entry for key, entry in self.entries.items() if entry[0] >= now}
+
+    async def resolve(self, guild, player_names):
+        """{user id: display name} for members named exactly like the ladder's players, querying only uncached names."""
+        now = time.monotonic()
+        if now >= self.next_prune:
+            self.prune(now)
+            self.next_prune = now + self.ttl
+        nicknames = {}
+        missing = []
+        for name in player_names:
+            members = self.get(guild.id, name, now)
+            if members is None:
+                missing.append(name)
+            else:
+                nicknames.update(members)
+        for chunk_start in range(0, len(missing), MEMBER_QUERY_CHUNK):
+            chunk = missing[chunk_start:chunk_start + MEMBER_QUERY_CHUNK]
+            results = await asyncio.gather(*[
+                observe_api("query_members", guild.query_members(query=name, limit=MEMBER_QUERY_LIMIT, cache=False))
+                for name in chunk])
+            for name, found in zip(chunk, results):
+                # query_members is a prefix search, so "Ross" also finds "Rossi"
+                members = {str(member.id): member.display_name for member in found
+                           if member.display_name.lower() == name.lower()}
+                self.put(guild.id, name, members, now)
+                nicknames.update(members)
+        return nicknames
+
@@ -0,0 +1,68 @@
+"""Compare the memory needed to show display names with the full member cache and with MemberNameCache.
+
+    python bosspiles_memory.py"""
+import gc
+import os
+import time
+import tracemalloc
+
+from bosspiles_members import MemberNameCache
+
+
+class SimulatedMember:
+    """Roughly what discord.py keeps per cached Member: ids, names, roles and timestamps."""
+    def __init__(self, member_id):
+        self.id = member_id
+        self.name = f"member{member_id}"
+        self.nick = f"Member {member_id}" if member_id % 3 == 0 else None
+        self.discriminator = f"{member_id % 10000:04d}"
+        self.avatar = f"{member_id:032x}"
+        self.roles = [member_id % 17, member_id % 29]
+        self.joined_at = 1600000000.0 + member_id
+        self.activities = ()
+        self.bot = False
+
+    @property
+    def display_name(self):
+        return self.nick or self.name
+
+
+def resident_bytes():
+    """Resident set size of this process (Linux only, 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def simulate_memory(num_members=50000, ladder_size=60):
+    """Memory used to hold member names for one command: the full member cache plus the
+    id => name dict run_bosspiles builds from it, versus the lean cache for only the ladder's players.
+    Returns {mode: (bytes allocated, resident bytes before, resident bytes after)}."""
+    report = {}
+    tracemalloc.start()
+    gc.collect()
+    rss_before = resident_bytes()
+    before = tracemalloc.get_traced_memory()[0]
+    member_cache = {member_id: SimulatedMember(member_id) for member_id in range(num_members)}
+    nicknames = {str(member.id): member.display_name for member in member_cache.values()}
+    report["full"] = (tracemalloc.get_traced_memory()[0] - before, rss_before, resident_bytes())
+    del member_cache, nicknames
+    gc.collect()
+
+    rss_before = resident_bytes()
+    before = tracemalloc.get_traced_memory()[0]
+    lean_cache = MemberNameCache()
+    for member_id in range(0, ladder_size * 7, 7):
+        member = SimulatedMember(member_id)
+        lean_cache.put(1, member.display_name, {str(member.id): member.display_name}, time.monotonic())
+    report["lean"] = (tracemalloc.get_traced_memory()[0] - before, rss_before, resident_bytes())
+    tracemalloc.stop()
+    return report
+
+
+if __name__ == "__main__":
+    for mode, (allocated, rss_before, rss_after) in simulate_memory().items():
+        print(f"{mode}: {allocated / 2**20:.2f} MiB allocated, "
+              f"resident {rss_before / 2**20:.1f} MiB => {rss_after / 2**20:.1f} MiB")
@@ -0,0 +1,181 @@
+"""In-process metrics for the bosspiles bot, served in Prometheus text format.
+
+Updating a metric is a dict lookup and an addition so it is cheap enough for on_message.
+Rendering only happens when something scrapes METRICS_PORT."""
+import asyncio
+from bisect import bisect_left
+import logging
+import time
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9477
+# Set by bosspiles_deploy.py so each shard process serves metrics on its own port
+METRICS_PORT_ENV = "BOSSPILES_METRICS_PORT"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _format_labels(labelnames, labels, extra=""):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels."""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def render(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram:
+    """Distribution of observed values (usually seconds) in fixed buckets."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels => [per-bucket counts (last is +Inf), sum, count]
+        self.values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels):
+        series = self.values.get(labels)
+        return series[2] if series else 0
+
+    def render(self):
+        for labels, (bucket_counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+COMMANDS = Counter("bosspiles_commands_total", "Commands received by type.", ["command"])
+COMMAND_LATENCY = Histogram("bosspiles_command_seconds", "Time to run a command and send its reply.", ["command"])
+COMMAND_ROUND_TRIPS = Histogram("bosspiles_command_round_trips", "Discord API calls made per command.", ["command"],
+                                buckets=(1, 2, 3, 4, 5, 8, 13))
+ERRORS = Counter("bosspiles_errors_total", "Unhandled errors by where they happened.", ["where"])
+API_LATENCY = Histogram("bosspiles_discord_api_seconds", "Latency of Discord API calls by call type.", ["call"])
+RATE_LIMITS = Counter("bosspiles_rate_limit_hits_total", "429s that discord.py waited out, by route or global.", ["scope"])
+CACHE_REQUESTS = Counter("bosspiles_cache_requests_total", "Cache lookups by cache and hit/miss.", ["cache", "result"])
+PIN_REBASES = Counter("bosspiles_pin_rebases_total", "Commands rerun because the pin changed after it was read.")
+LOOP_LAG = Gauge("bosspiles_event_loop_lag_seconds", "How late the last event loop lag probe woke up.")
+
+
+def record_cache(cache, hit):
+    """Count one cache lookup."""
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+class RateLimitCounter(logging.Handler):
+    """Count the 429s that discord.py retries on its own, from the warnings it logs on discord.http.
+    They never reach our code as exceptions."""
+    def emit(self, record):
+        message = str(record.msg)
+        if message.startswith("We are being rate limited"):
+            RATE_LIMITS.inc("route")
+        elif message.startswith("Global rate limit"):
+            RATE_LIMITS.inc("global")
+
+
+def count_rate_limits(logger_name="discord.http"):
+    """Start counting discord.py's rate limit warnings. Safe to call more than once."""
+    logger = logging.getLogger(logger_name)
+    if not any(isinstance(handler, RateLimitCounter) for handler in logger.handlers):
+        logger.addHandler(RateLimitCounter(logging.WARNING))
+
+
+async def observe_api(call, awaitable):
+    """Await a Discord API call, recording its latency (including any time discord.py spends rate limited)."""
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        API_LATENCY.observe(time.perf_counter() - started, call)
+
+
+def render_metrics():
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Drain the headers; we don't use them
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if request_line.split(b" ")[1:2] == [b"/metrics"]:
+            status, body = "200 OK", render_metrics().encode()
+        else:
+            status, body = "404 Not Found", b"Try /metrics\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics on a local port from the running event loop."""
+    return await asyncio.start_server(_handle_scrape, host, port)
+
+
+async def monitor_loop_lag(interval=1.0):
+    """Forever measure how late the event loop wakes us up compared to when we asked."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.set(max(0.0, time.perf_counter() - started - interval))
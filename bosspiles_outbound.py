@@ -0,0 +1,357 @@
+"""Outbound Discord traffic, planned up front so it can be merged and rate limited."""
+import asyncio
+import heapq
+import itertools
+import time
+
+import discord
+
+from bosspiles_metrics import observe_api
+from bosspiles_shards import DISCORD_MESSAGE_LIMIT, split_shards
+
+
+def iter_message_parts(pieces, chars_per_msg=DISCORD_MESSAGE_LIMIT):
+    """Split text, or an iterable of text pieces like rendered bosspile lines, into Discord sized parts.
+    Parts only break on newlines. This is one pass that holds at most about one message of text."""
+    if isinstance(pieces, str):
+        pieces = [pieces]
+    remainder = ""
+    pending = []
+    pending_len = 0
+    after_break = False  # remainder starts right after a break and still needs to be fixed up
+    for piece in pieces:
+        pending.append(piece)
+        pending_len += len(piece)
+        if len(remainder) + pending_len > chars_per_msg:
+            remainder += "".join(pending)
+            pending = []
+            pending_len = 0
+            remainder, after_break = _fix_break(remainder, after_break)
+            while not after_break and len(remainder) > chars_per_msg:
+                msg_part, remainder = _split_part(remainder, chars_per_msg)
+                remainder, after_break = _fix_break(remainder, True)
+                yield msg_part
+    remainder, after_break = _fix_break(remainder + "".join(pending), after_break)
+    while len(remainder) > chars_per_msg:
+        msg_part, remainder = _split_part(remainder, chars_per_msg)
+        remainder, _ = _fix_break(remainder, True)
+        yield msg_part
+    if remainder:
+        yield remainder
+
+
+def _split_part(remainder, chars_per_msg):
+    """Take the longest part that ends before a newline (or exactly chars_per_msg if there isn't one)."""
+    # Only break on newline
+    newline_pos = remainder.rfind("\n", 1, chars_per_msg + 1)
+    if newline_pos == -1:
+        newline_pos = chars_per_msg
+    return remainder[:newline_pos], remainder[newline_pos:]
+
+
+def _fix_break(remainder, after_break):
+    """Drop the newlines at a break. Returns whether we're still waiting for text after the break."""
+    if not after_break:
+        return remainder, False
+    remainder = remainder.lstrip("\n")
+    if not remainder:
+        return remainder, True
+    # Discord will delete whitespace before a message
+    # so preserve that whitespace by inserting a character
+    if remainder[0] == "\t":
+        remainder = ".   " + remainder[1:]
+    return remainder, False
+
+
+def strip_suffix(text, suffix):
+    """Remove suffix from the end of text if it is there."""
+    if suffix and text.endswith(suffix):
+        return text[:-len(suffix)]
+    return text
+
+
+PRIORITY_PIN = 0
+PRIORITY_REPLY = 1
+PRIORITY_BULK = 2
+# Minimum seconds between two calls to one channel and between any two calls
+OUTBOUND_CHANNEL_INTERVAL = 0.2
+OUTBOUND_GLOBAL_INTERVAL = 0.02
+MAX_SEND_ATTEMPTS = 5
+
+
+class OutboundCall:
+    """One queued Discord call. Sends with the same group (e.g. one command's messages) may be merged."""
+    def __init__(self, seq, channel, priority, call_name, make_call, not_before=0, content=None, group=None):
+        self.seq = seq
+        self.channel = channel
+        self.priority = priority
+        self.call_name = call_name
+        self.make_call = make_call
+        self.not_before = not_before
+        self.content = content
+        self.group = group
+        self.attempts = 0
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class OutboundQueue:
+    """Every Discord call the bot makes, started by one worker in priority order.
+    Calls to different channels run concurrently but each channel's run one at a time, spaced per channel
+    and globally. Consecutive sends to a channel from the same group are merged when they fit in one message;
+    sends from different groups (i.e. different commands) never are. discord.py waits out short rate limits itself
+    and raises RateLimited for ones longer than the client's max_ratelimit_timeout. Then only the call's channel
+    is held for retry_after and the call is retried."""
+    def __init__(self, channel_interval=OUTBOUND_CHANNEL_INTERVAL, global_interval=OUTBOUND_GLOBAL_INTERVAL):
+        self.channel_interval = channel_interval
+        self.global_interval = global_interval
+        self.pending = []
+        self.seq = itertools.count()
+        self.channel_ready = {}
+        self.busy_channels = set()
+        self.calls_in_flight = set()
+        self.global_ready = 0
+        self.wakeup = None
+        self.worker = None
+
+    async def submit(self, channel, priority, call_name, make_call, not_before=0, content=None, group=None):
+        """Queue make_call() and return its result once it has been made."""
+        queued = OutboundCall(next(self.seq), channel, priority, call_name, make_call, not_before, content, group)
+        self.pending.append(queued)
+        self.wake()
+        return await queued.future
+
+    async def send(self, destination, content, priority=PRIORITY_REPLY, not_before=0, group=None):
+        """Queue a message. Waiting messages with the same group are sent together if they fit."""
+        return await self.submit(destination, priority, "send", lambda: destination.send(content), not_before,
+                                 content, group)
+
+    @staticmethod
+    def channel_key(channel):
+        return getattr(channel, "id", id(channel))
+
+    def wake(self):
+        """Tell the worker there is something new to send, starting it if it isn't running."""
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.run())
+            self.worker.add_done_callback(self.worker_done)
+
+    def next_ready(self, now):
+        """The first call by priority that may be made now, or (None, seconds until one may be).
+        The wait is None when every waiting call's channel is busy."""
+        wait = None
+        for queued in sorted(self.pending, key=lambda queued: (queued.priority, queued.seq)):
+            channel_key = self.channel_key(queued.channel)
+            if channel_key in self.busy_channels:
+                continue
+            ready_at = max(queued.not_before, self.global_ready, self.channel_ready.get(channel_key, 0))
+            if ready_at <= now:
+                return queued, 0
+            wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        return None, wait
+
+    def take_merged(self, first, now):
+        """first plus the sends of its group queued right after it to the same channel that fit in one message."""
+        batch = [first]
+        content_len = len(first.content)
+        for queued in sorted(self.pending, key=lambda queued: queued.seq):
+            if queued.seq <= first.seq or self.channel_key(queued.channel) != self.channel_key(first.channel):
+                continue
+            if queued.group is not first.group or queued.priority != first.priority or queued.not_before > now \
+                    or content_len + 1 + len(queued.content) > DISCORD_MESSAGE_LIMIT:
+                break
+            batch.append(queued)
+            content_len += 1 + len(queued.content)
+        for queued in batch:
+            self.pending.remove(queued)
+        return batch
+
+    async def run(self):
+        while self.pending:
+            now = time.monotonic()
+            queued, wait = self.next_ready(now)
+            if queued is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if queued.group is not None and queued.content is not None:
+                batch = self.take_merged(queued, now)
+            else:
+                batch = [queued]
+                self.pending.remove(queued)
+            channel_key = self.channel_key(queued.channel)
+            self.busy_channels.add(channel_key)
+            self.channel_ready[channel_key] = now + self.channel_interval
+            self.global_ready = now + self.global_interval
+            call_task = asyncio.ensure_future(self.make(batch, channel_key))
+            self.calls_in_flight.add(call_task)  # The loop only keeps weak references to tasks
+            call_task.add_done_callback(self.calls_in_flight.discard)
+
+    def worker_done(self, worker):
+        """Fail the waiting calls if the worker died, instead of leaving their callers waiting forever."""
+        if worker.cancelled() or worker.exception() is None:
+            return
+        error = worker.exception()
+        for queued in self.pending:
+            if not queued.future.done():
+                queued.future.set_exception(error)
+        self.pending = []
+
+    async def make(self, batch, channel_key):
+        """Make one call for the batch and resolve their futures with its result, requeuing them after a rate limit."""
+        first = batch[0]
+        try:
+            if len(batch) > 1:
+                call = first.channel.send("\n".join([queued.content for queued in batch]))
+            else:
+                call = first.make_call()
+            result = await observe_api(first.call_name, call)
+        except discord.RateLimited as e:
+            first.attempts += 1
+            if first.attempts < MAX_SEND_ATTEMPTS:
+                self.channel_ready[channel_key] = max(self.channel_ready.get(channel_key, 0),
+                                                      time.monotonic() + e.retry_after)
+                self.pending += batch
+            else:
+                self.resolve(batch, error=e)
+        except Exception as e:
+            self.resolve(batch, error=e)
+        else:
+            self.resolve(batch, result)
+        finally:
+            self.busy_channels.discard(channel_key)
+            if self.pending:
+                self.wake()
+
+
+    @staticmethod
+    def resolve(batch, result=None, error=None):
+        for queued in batch:
+            if queued.future.done():
+                continue
+            if error is not None:
+                queued.future.set_exception(error)
+            else:
+                queued.future.set_result(result)
+
+
+class CommandPlan:
+    """All of the Discord calls one command will make, decided before any are sent.
+    Notices are merged into the reply so that they don't cost their own message,
+    round_trips counts every call (reads included) for regression checks,
+    and on_saved callbacks run once the pin changes have all been made."""
+    def __init__(self, channel, outbound=None):
+        self.channel = channel
+        self.outbound = outbound
+        self.reply = ""
+        self.reply_parts = None  # The reply already split into messages, for static replies
+        self.notices = []
+        self.pin_edits = []
+        self.new_pins = []
+        self.unpins = []
+        self.on_saved = []
+        self.round_trips = 0
+
+    def count_calls(self, num_calls=1):
+        """Record Discord calls made outside of the plan, like `pins()`."""
+        self.round_trips += num_calls
+
+    def edit_pin(self, pile_pin, new_content, ignored_suffix=""):
+        """Update a ShardedPin, editing only the shards whose content changes and adding or
+        unpinning shards as the pile grows or shrinks. Nothing is edited if the only change
+        would be to ignored_suffix (i.e. the contributor line)."""
+        # Discord trims trailing whitespace, so it can't count as a change
+        if strip_suffix(new_content, ignored_suffix).rstrip() == strip_suffix(pile_pin.content, ignored_suffix).rstrip():
+            return
+        new_shards = split_shards(new_content, [shard.content for shard in pile_pin.shards])
+        for shard, shard_content in zip(pile_pin.shards, new_shards):
+            if shard.content.rstrip() != shard_content.rstrip():
+                self.pin_edits.append((shard, shard_content))
+        self.new_pins += new_shards[len(pile_pin.shards):]
+        self.unpins += pile_pin.shards[len(new_shards):]
+
+    def replace_pin(self, new_content, notice=""):
+        """Send and pin new messages, for when the pin isn't ours to edit."""
+        self.new_pins += split_shards(new_content)
+        if notice:
+            self.notices.append(notice)
+
+    def message_parts(self):
+        """The reply with notices merged in, split into the messages that will be sent."""
+        if self.reply_parts is not None and not self.notices:
+            return list(self.reply_parts)
+        merged_reply = "\n".join([text for text in [self.reply, *self.notices] if text])
+        return list(iter_message_parts(merged_reply))
+
+    async def call(self, priority, call_name, make_call):
+        """Make one call, through the outbound queue if the plan has one."""
+        self.round_trips += 1
+        if self.outbound:
+            return await self.outbound.submit(self.channel, priority, call_name, make_call)
+        return await observe_api(call_name, make_call())
+
+    async def execute(self):
+        """Make the planned calls: pin changes first, then the on_saved callbacks, then the reply."""
+        for pin, new_content in self.pin_edits:
+            await self.call(PRIORITY_PIN, "edit", lambda pin=pin, new_content=new_content: pin.edit(content=new_content))
+        for new_content in self.new_pins:
+            new_msg = await self.call(PRIORITY_PIN, "send", lambda new_content=new_content: self.channel.send(new_content))
+            await self.call(PRIORITY_PIN, "pin", new_msg.pin)
+        for pin in self.unpins:
+            await self.call(PRIORITY_PIN, "unpin", lambda pin=pin: pin.unpin(reason="Bosspile got shorter"))
+        for callback in self.on_saved:
+            callback()
+        if self.outbound:
+            # Queued together so the queue can merge them
+            msg_parts = self.message_parts()
+            self.round_trips += len(msg_parts)
+            await asyncio.gather(*[self.outbound.send(self.channel, msg_part, PRIORITY_REPLY, group=self)
+                                   for msg_part in msg_parts])
+            return self.round_trips
+        for msg_part in self.message_parts():
+            await self.call(PRIORITY_REPLY, "send", lambda msg_part=msg_part: self.channel.send(msg_part))
+        return self.round_trips
+
+
+def batch_messages(lines, batch_size, separator="\n", chars_per_msg=DISCORD_MESSAGE_LIMIT):
+    """Pack lines into as few messages as possible, with at most batch_size lines per message."""
+    messages = []
+    batch = []
+    batch_len = 0
+    for line in lines:
+        added_len = len(line) + len(separator) * bool(batch)
+        if batch and (len(batch) >= batch_size or batch_len + added_len > chars_per_msg):
+            messages.append(separator.join(batch))
+            batch = []
+            batch_len = 0
+            added_len = len(line)
+        batch.append(line)
+        batch_len += added_len
+    if batch:
+        messages.append(separator.join(batch))
+    return messages
+
+
+def plan_sends(channel_messages, global_interval, channel_interval):
+    """Schedule every channel's messages so that no two sends are closer than global_interval
+    and no two sends to one channel are closer than channel_interval. Channel order is kept.
+    channel_messages is a list of (channel, [message, ...]). Returns [(seconds from now, channel, message)]."""
+    schedule = []
+    # (earliest allowed time, channel index, message index)
+    ready = [(0, i, 0) for i, (_, messages) in enumerate(channel_messages) if messages]
+    heapq.heapify(ready)
+    next_global = 0
+    while ready:
+        earliest, chan_idx, msg_idx = heapq.heappop(ready)
+        send_at = max(earliest, next_global)
+        channel, messages = channel_messages[chan_idx]
+        schedule.append((send_at, channel, messages[msg_idx]))
+        next_global = send_at + global_interval
+        if msg_idx + 1 < len(messages):
+            heapq.heappush(ready, (send_at + channel_interval, chan_idx, msg_idx + 1))
+    return schedule
@@ -0,0 +1,76 @@
+"""Elo ratings per player per channel, alongside the ladder order.
+
+Ratings for a channel are rebuilt from the result history the first time they are asked for,
+then kept up to date one result at a time."""
+from bosspiles import player_key
+
+INITIAL_RATING = 1500
+K_FACTOR = 32
+
+
+def expected_score(rating, opponent_rating):
+    """Probability that a player with rating beats a player with opponent_rating."""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def apply_result(ratings, games_played, winner, losers, k_factor=K_FACTOR):
+    """Update ratings in place for one result. A multiplayer win is scored as the winner beating
+    each loser, with K split between them so a 4 player win isn't worth 3 two player wins."""
+    if not losers:
+        return
+    k = k_factor / len(losers)
+    winner_rating = ratings.get(winner, INITIAL_RATING)
+    winner_change = 0
+    for loser in losers:
+        loser_rating = ratings.get(loser, INITIAL_RATING)
+        change = k * (1 - expected_score(winner_rating, loser_rating))
+        winner_change += change
+        ratings[loser] = loser_rating - change
+        games_played[loser] = games_played.get(loser, 0) + 1
+    ratings[winner] = winner_rating + winner_change
+    games_played[winner] = games_played.get(winner, 0) + 1
+
+
+class RatingEngine:
+    """Ratings and games played by channel, keyed by player_key."""
+    def __init__(self, history):
+        self.history = history
+        self.ratings = {}
+        self.games_played = {}
+
+    def recompute(self, channel):
+        """Rebuild a channel's ratings from its whole history in one pass."""
+        ratings, games_played = {}, {}
+        for winner, losers in self.history.win_results(channel):
+            apply_result(ratings, games_played, winner, losers)
+        self.ratings[channel] = ratings
+        self.games_played[channel] = games_played
+        return ratings
+
+    def record(self, channel, events):
+        """Apply a command's win events. Channels that haven't been loaded are left for recompute,
+        which will read these results from the history, so the win path never replays history."""
+        if channel not in self.ratings:
+            return
+        for event in events:
+            if event.command == "win":
+                apply_result(self.ratings[channel], self.games_played[channel],
+                             player_key(event.player), [player_key(loser) for loser in event.others])
+
+    def view(self, channel, bosspile):
+        """Ratings of the players in this pile, best first."""
+        ratings = self.ratings.get(channel)
+        if ratings is None:
+            ratings = self.recompute(channel)
+        games_played = self.games_played[channel]
+        rows = []
+        for player in bosspile.players:
+            if '**' not in player.username and '__' in player.username:
+                continue  # heading
+            key = player.key
+            rows.append((ratings.get(key, INITIAL_RATING), games_played.get(key, 0), player.username))
+        rows.sort(key=lambda row: -row[0])
+        lines = [f"__**{bosspile.game} ratings**__"]
+        for rank, (rating, num_games, username) in enumerate(rows, 1):
+            lines.append(f"{rank}. {username} {round(rating)} ({num_games} games)")
+        return "\n".join(lines)
@@ -0,0 +1,215 @@
+"""Replay the commands recorded in the errs log against local piles, to measure changes on real traffic.
+
+run_bosspiles logs each command as "Received message in #<channel> (<guild id>) `<content>`", with DM for both
+in direct messages.
+Commands are replayed in order, at their original pace scaled by --speed (0 for as fast as possible),
+against piles loaded from --piles (<channel>.txt, as exported for bosspiles_cli.py). With --standin,
+each command also goes through CommandPlan against a local channel that keeps the pins and waits
+--api-latency ms per call, so pin sharding and message chunking are included in the timings.
+
+    python bosspiles_replay.py errs errs.1 --piles exports/ --speed 0 --standin"""
+import argparse
+import asyncio
+import datetime as dt
+import os
+import re
+import shlex
+import time
+
+from bosspiles import BossPile
+from bosspiles_cli import REPLAY_COMMANDS, replay_command
+from bosspiles_outbound import CommandPlan
+from bosspiles_shards import ShardedPin
+
+LOG_RECORD_RE = re.compile(r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) \| [^|\n]* \| \w+ \| ", re.MULTILINE)
+LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+RECEIVED_RE = re.compile(r"Received message(?: in #(\S+) \((\w+)\))? `(.*)`\s*$", re.DOTALL)
+UNKNOWN_CHANNEL = "unknown"
+
+
+class LoggedCommand:
+    """One command from the log."""
+    def __init__(self, when, channel, guild, content):
+        self.when = when
+        self.channel = channel
+        self.guild = guild
+        self.content = content
+
+
+def read_logged_commands(log_paths):
+    """Every logged command in the log files, oldest first. Older lines without a channel get UNKNOWN_CHANNEL."""
+    commands = []
+    for log_path in log_paths:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            log_text = f.read()
+        records = list(LOG_RECORD_RE.finditer(log_text))
+        for record, next_record in zip(records, records[1:] + [None]):
+            message = log_text[record.end():next_record.start() if next_record else len(log_text)]
+            received = RECEIVED_RE.match(message)
+            if received:
+                when = dt.datetime.strptime(record[1], LOG_TIME_FORMAT).timestamp()
+                commands.append(LoggedCommand(when, received[1] or UNKNOWN_CHANNEL, received[2] or "", received[3]))
+    commands.sort(key=lambda command: command.when)
+    return commands
+
+
+class StandinMessage:
+    """A message in a StandinChannel."""
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content.rstrip()  # Discord trims trailing whitespace
+        self.author = "bosspiles bot"
+        self.id = len(channel.sent)
+
+    async def edit(self, content):
+        await self.channel.api_call()
+        self.content = content.rstrip()
+
+    async def pin(self):
+        await self.channel.api_call()
+        self.channel.pinned.append(self)
+
+    async def unpin(self, reason):
+        await self.channel.api_call()
+        self.channel.pinned.remove(self)
+
+
+class StandinChannel:
+    """A local Discord channel that keeps its messages and pins and takes api_latency seconds per call."""
+    def __init__(self, name, pile_text, api_latency=0):
+        self.name = name
+        self.api_latency = api_latency
+        self.sent = []
+        self.pinned = [StandinMessage(self, pile_text)]
+
+    async def api_call(self):
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    async def send(self, content):
+        await self.api_call()
+        message = StandinMessage(self, content)
+        self.sent.append(message)
+        return message
+
+    async def pins(self):
+        await self.api_call()
+        return list(self.pinned)
+
+
+def command_kind(content):
+    """The full name of a pile command, or None for commands that don't touch the pile."""
+    try:
+        args = shlex.split(content.lstrip("$"))
+    except ValueError:
+        return None
+    if not args:
+        return None
+    for cmd in REPLAY_COMMANDS + ["print"]:
+        if cmd.startswith(args[0].lower()):
+            return cmd
+    return None
+
+
+def percentile_ms(sorted_seconds, fraction):
+    return sorted_seconds[min(len(sorted_seconds) - 1, int(len(sorted_seconds) * fraction))] * 1000
+
+
+class ReplayReport:
+    """Latency per command kind and overall throughput."""
+    def __init__(self):
+        self.latencies = {}
+        self.skipped = 0
+        self.elapsed = 0
+
+    def add(self, kind, seconds):
+        self.latencies.setdefault(kind, []).append(seconds)
+
+    def render(self):
+        all_latencies = sorted([latency for latencies in self.latencies.values() for latency in latencies])
+        lines = [f"Replayed {len(all_latencies)} commands ({self.skipped} skipped) in {self.elapsed:.2f}s, "
+                 f"{len(all_latencies) / self.elapsed if self.elapsed else 0:.1f} commands/s"]
+        for kind, latencies in sorted(self.latencies.items()) + [("all", all_latencies)]:
+            latencies = sorted(latencies)
+            if not latencies:
+                continue
+            lines.append(f"{kind:>8}: n={len(latencies)} p50={percentile_ms(latencies, 0.5):.2f}ms "
+                         f"p95={percentile_ms(latencies, 0.95):.2f}ms p99={percentile_ms(latencies, 0.99):.2f}ms "
+                         f"max={latencies[-1] * 1000:.2f}ms")
+        return "\n".join(lines)
+
+
+def load_piles(piles_dir, default_pile=None):
+    """channel name => pile text from <channel>.txt files, plus the default pile under UNKNOWN_CHANNEL."""
+    piles = {}
+    if piles_dir:
+        for name in os.listdir(piles_dir):
+            if name.endswith(".txt"):
+                with open(os.path.join(piles_dir, name), encoding="utf-8") as f:
+                    piles[name[:-len(".txt")]] = f.read()
+    if default_pile:
+        with open(default_pile, encoding="utf-8") as f:
+            piles[UNKNOWN_CHANNEL] = f.read()
+    return piles
+
+
+async def replay(commands, piles, speed=0, standin=False, api_latency=0, channels=None):
+    """Run each command against its channel's pile, keeping the state between commands.
+    State is kept per (guild id, channel name) in channels, since channel names repeat across guilds.
+    Commands for channels without a pile (and that don't change or print the pile) are skipped."""
+    report = ReplayReport()
+    channels = {} if channels is None else channels
+    started = time.monotonic()
+    first_when = commands[0].when if commands else 0
+    for command in commands:
+        kind = command_kind(command.content)
+        pile_text = piles.get(command.channel, piles.get(UNKNOWN_CHANNEL))
+        if kind is None or pile_text is None:
+            report.skipped += 1
+            continue
+        if speed:
+            await asyncio.sleep(max(0, started + (command.when - first_when) / speed - time.monotonic()))
+        channel_key = (command.guild, command.channel)
+        if channel_key not in channels:
+            channels[channel_key] = StandinChannel(command.channel, pile_text, api_latency)
+        channel = channels[channel_key]
+        command_started = time.perf_counter()
+        if standin:
+            pile_pin = ShardedPin.from_bot_pins(await channel.pins())
+        else:
+            pile_pin = ShardedPin(channel.pinned)
+        bosspile = BossPile(channel.name, {}, pile_pin.content)
+        if kind == "print":
+            reply = bosspile.generate_bosspile()
+        else:
+            reply = replay_command(bosspile, command.content)
+        new_pile = bosspile.generate_bosspile()
+        if standin:
+            plan = CommandPlan(channel)
+            plan.reply = reply
+            plan.edit_pin(pile_pin, new_pile)
+            await plan.execute()
+        elif new_pile.rstrip() != pile_pin.content.rstrip():
+            channel.pinned = [StandinMessage(channel, new_pile)]
+        report.add(kind, time.perf_counter() - command_started)
+    report.elapsed = time.monotonic() - started
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay logged bosspile commands and report latency and throughput.")
+    parser.add_argument("logs", nargs="+", help="errs log files (rotated ones too)")
+    parser.add_argument("--piles", help="directory of <channel>.txt starting piles")
+    parser.add_argument("--default-pile", help="pile for channels without their own, and for old log lines without a channel")
+    parser.add_argument("--speed", type=float, default=0, help="1 for the original pace, 10 for 10x, 0 for as fast as possible")
+    parser.add_argument("--standin", action="store_true", help="send replies and pin changes through a local channel")
+    parser.add_argument("--api-latency", type=float, default=0, help="ms per stand-in Discord call")
+    args = parser.parse_args()
+    commands = read_logged_commands(args.logs)
+    piles = load_piles(args.piles, args.default_pile)
+    report = asyncio.run(replay(commands, piles, args.speed, args.standin, args.api_latency / 1000))
+    print(report.render())
+
+
+if __name__ == "__main__":
+    main()
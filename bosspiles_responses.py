@@ -0,0 +1,78 @@
+"""Static replies like the help text, read, transformed and split into Discord messages once.
+
+Each response comes from a file and is only reread when the file's mtime or size changes.
+refresh() does the disk I/O and is meant to be run off of the event loop (the bot runs it in a
+thread every RESPONSE_REFRESH_SECONDS), so commands answer from memory."""
+import os
+
+from bosspiles_logging import get_logger
+from bosspiles_outbound import iter_message_parts
+
+RESPONSE_REFRESH_SECONDS = 30
+
+logger = get_logger(__name__)
+
+
+class StaticResponse:
+    """A file's text after its transform, and that text split into messages."""
+    def __init__(self, text, parts, signature):
+        self.text = text
+        self.parts = parts
+        self.signature = signature
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ResponseCache:
+    """name => StaticResponse for every registered file."""
+    def __init__(self):
+        self.sources = {}
+        self.fallbacks = {}
+        self.responses = {}
+        self.parts_by_text = {}
+        # Names whose file couldn't be read last time, so a missing file is only logged once
+        self.unreadable = set()
+
+    def register(self, name, path, transform=None, fallback=""):
+        """Serve a file as `name` once refresh() has loaded it, and fallback until then or if it never loads."""
+        self.sources[name] = (path, transform)
+        self.fallbacks[name] = fallback
+
+    def refresh(self):
+        """Reload files that changed on disk. Returns the names that were reloaded.
+        A file that can't be read keeps its last good response and is logged once, not on every refresh."""
+        reloaded = []
+        for name, (path, transform) in self.sources.items():
+            try:
+                signature = file_signature(path)
+                if name in self.responses and self.responses[name].signature == signature:
+                    self.unreadable.discard(name)
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    text = f.read()
+            except OSError as e:
+                if name not in self.unreadable:
+                    self.unreadable.add(name)
+                    logger.warning("Could not load the %s response from %s, keeping the last one: %s", name, path, e)
+                continue
+            self.unreadable.discard(name)
+            if transform:
+                text = transform(text)
+            self.responses[name] = StaticResponse(text, tuple(iter_message_parts(text)), signature)
+            reloaded.append(name)
+        if reloaded:
+            # Swapped whole so commands on the event loop never see it half built
+            self.parts_by_text = {response.text: response.parts for response in self.responses.values()}
+        return reloaded
+
+    def text(self, name):
+        if name in self.responses:
+            return self.responses[name].text
+        return self.fallbacks[name]
+
+    def parts_for(self, text):
+        """The precomputed messages if text is one of the static responses, else None."""
+        return self.parts_by_text.get(text)
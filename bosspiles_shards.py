@@ -0,0 +1,74 @@
+"""Bosspiles that are too long for one Discord message, stored across several bot pins.
+
+The first shard is a normal pile message starting with the title. Every other shard starts with
+a marker line like `-# bosspile part 2`, which the parser skips like any other `-` heading.
+The marker has no total so that adding a shard doesn't rewrite the others."""
+import re
+
+DISCORD_MESSAGE_LIMIT = 2000
+SHARD_MARKER_RE = re.compile(r"-# bosspile part (\d+)\n")
+# Room left in each shard for its marker line
+SHARD_MARKER_RESERVE = 30
+
+
+def shard_marker(shard_num):
+    return f"-# bosspile part {shard_num}\n"
+
+
+def shard_index(content):
+    """0-based position of a continuation shard, or None if the message isn't one."""
+    marker = SHARD_MARKER_RE.match(content)
+    if marker:
+        return int(marker[1]) - 1
+    return None
+
+
+def shard_body(content):
+    """Shard content without its marker line."""
+    return SHARD_MARKER_RE.sub("", content, count=1) if SHARD_MARKER_RE.match(content) else content
+
+
+class ShardedPin:
+    """A pinned bosspile made of one or more pinned messages, in order."""
+    def __init__(self, shards):
+        self.shards = shards
+        self.author = shards[0].author
+        self.id = shards[0].id
+        # Discord trims the trailing newline off each message, so put it back between shards
+        bodies = [shard_body(shard.content) for shard in shards]
+        self.content = "".join([body if body.endswith("\n") else body + "\n" for body in bodies[:-1]] + bodies[-1:])
+
+    @classmethod
+    def from_bot_pins(cls, bot_pins):
+        """Order this bot's pins into one pile: the newest unmarked pin, then its continuation shards."""
+        first_shards = [pin for pin in bot_pins if shard_index(pin.content) is None]
+        if not first_shards:
+            return None
+        continuations = sorted([pin for pin in bot_pins if shard_index(pin.content) is not None],
+                               key=lambda pin: shard_index(pin.content))
+        return cls(first_shards[:1] + continuations)
+
+
+def split_shards(text, old_shards=(), chars_per_msg=DISCORD_MESSAGE_LIMIT):
+    """Split pile text into shard contents (markers included) that each fit in a message.
+    Where an old shard's first line is still there, the new shard starts at the same line so that
+    a change only rewrites the shards it touches instead of shifting every later shard."""
+    if len(text) <= chars_per_msg:
+        return [text]
+    body_limit = chars_per_msg - SHARD_MARKER_RESERVE
+    anchors = [shard_body(shard).splitlines(keepends=True)[0] for shard in old_shards[1:] if shard_body(shard).strip()]
+    bodies = []
+    current = []
+    current_len = 0
+    for line in text.splitlines(keepends=True):
+        at_anchor = line in anchors
+        if current and (at_anchor or current_len + len(line) > body_limit):
+            bodies.append("".join(current))
+            current = []
+            current_len = 0
+        if at_anchor:
+            anchors = anchors[anchors.index(line) + 1:]
+        current.append(line)
+        current_len += len(line)
+    bodies.append("".join(current))
+    return [bodies[0]] + [shard_marker(i + 1) + body for i, body in enumerate(bodies) if i > 0]
@@ -0,0 +1,72 @@
+"""Precomputed `$win` results for every player in every open match of a pile.
+
+After a pile changes, a background task plays out each possible win on a copy of the pile, yielding
+to the event loop between outcomes. A `$win` on that same pile then commits the stored result instead
+of recomputing it. Only the latest pile of each channel is kept, so memory is bounded by
+SPECULATION_MAX_CHANNELS piles times the players in their open matches."""
+import asyncio
+import copy
+
+from bosspiles import BossPile
+from bosspiles_metrics import record_cache
+
+SPECULATION_MAX_CHANNELS = 32
+
+
+class SpeculatedPile:
+    """A pile as parsed once, and {username: (BossPile after their win, reply, rendered pile)}."""
+    def __init__(self, pile_text, nicknames, base):
+        self.pile_text = pile_text
+        self.nicknames = nicknames
+        self.base = base
+        self.outcomes = {}
+
+
+class OutcomeCache:
+    """channel name => SpeculatedPile for the pile that was last saved in that channel."""
+    def __init__(self, max_channels=SPECULATION_MAX_CHANNELS):
+        self.max_channels = max_channels
+        self.entries = {}
+        self.tasks = set()
+
+    def is_current(self, channel_name, pile_text, nicknames):
+        entry = self.entries.get(channel_name)
+        # Discord trims trailing whitespace off of pins
+        return entry is not None and entry.pile_text == pile_text.rstrip() and entry.nicknames == nicknames
+
+    def refresh(self, channel_name, nicknames, pile_text):
+        """Start speculating on a channel's new pile, replacing (and so stopping) any speculation on the old one."""
+        if self.is_current(channel_name, pile_text, nicknames):
+            return
+        entry = SpeculatedPile(pile_text.rstrip(), nicknames, BossPile(channel_name, nicknames, pile_text))
+        self.entries.pop(channel_name, None)
+        self.entries[channel_name] = entry
+        while len(self.entries) > self.max_channels:
+            self.entries.pop(next(iter(self.entries)))
+        task = asyncio.ensure_future(self.speculate(channel_name, entry))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def speculate(self, channel_name, entry):
+        """Play out every possible win on the entry's pile until done or the channel's pile changes."""
+        for match in entry.base.generate_matches():
+            for player in match:
+                await asyncio.sleep(0)  # Let commands run between outcomes
+                if self.entries.get(channel_name) is not entry:
+                    return
+                bosspile = copy.copy(entry.base)
+                bosspile.players = [copy.copy(pile_player) for pile_player in entry.base.players]
+                bosspile.events = []
+                reply = bosspile.win(player.username)
+                entry.outcomes[player.username] = (bosspile, reply, bosspile.generate_bosspile())
+
+    def take(self, channel_name, pile_text, nicknames, victor):
+        """(BossPile after the win, reply, rendered pile) if this win on this pile was precomputed, else None."""
+        if not self.is_current(channel_name, pile_text, nicknames):
+            record_cache("outcomes", False)
+            return None
+        entry = self.entries[channel_name]
+        victor_name, victor_pos, err = entry.base.find_player_pos(victor)
+        outcome = entry.outcomes.get(victor_name) if not err else None
+        record_cache("outcomes", outcome is not None)
+        return outcome
@@ -0,0 +1,57 @@
+"""Version stamps on bot-rendered piles, to catch a pile saved elsewhere between reading and writing it.
+
+The stamp is a subtext line under the title, like `-# v12`: a counter bumped on every save. The parser
+skips it like any other `-` heading. PinVersions remembers the newest stamp seen on each channel, from the
+pins commands read and save and from the gateway's edit events, so a command can tell its base is stale
+(another instance saved a newer version) without fetching the pins again."""
+import re
+
+# Older stamps also had a checksum after the version, which is ignored
+VERSION_RE = re.compile(r"^-# v(\d+)(?: [0-9a-f]{8})?\n", re.MULTILINE)
+
+
+def strip_version(pile_text):
+    """Pile text without its version line."""
+    return VERSION_RE.sub("", pile_text, count=1)
+
+
+def pile_version(pile_text):
+    """The version from the stamp, or 0 for a pile without one."""
+    stamp = VERSION_RE.search(pile_text)
+    return int(stamp[1]) if stamp else 0
+
+
+def stamp_version(pile_text, version):
+    """Pile text with a version line for this version under its first line."""
+    pile_text = strip_version(pile_text)
+    title, newline, rest = pile_text.partition("\n")
+    return f"{title}\n-# v{version}\n{rest}" if newline else pile_text
+
+
+def pile_changed(old_text, new_text):
+    # Discord trims trailing whitespace, so it can't count as a change
+    return strip_version(old_text).rstrip() != strip_version(new_text).rstrip()
+
+
+class PinVersions:
+    """channel id => newest pile version seen on that channel."""
+    def __init__(self):
+        self.latest = {}
+
+    def see(self, channel_id, pile_text):
+        version = pile_version(pile_text)
+        if version > self.latest.get(channel_id, 0):
+            self.latest[channel_id] = version
+
+    def is_stale(self, channel_id, base_text):
+        """Whether a newer version of the pile than base_text has been seen on the channel."""
+        return pile_version(base_text) < self.latest.get(channel_id, 0)
+
+    def next_version(self, channel_id, base_text):
+        """The version to stamp a pile saved from base_text with. It is above every version seen on the channel,
+        so a pile that starts over (a new pin after `$unpin`, or `$pin` of a person's message) isn't stale."""
+        return max(pile_version(base_text), self.latest.get(channel_id, 0)) + 1
+
+    def reset(self, channel_id, pile_text):
+        """Trust a freshly fetched pin's version over what was seen before."""
+        self.latest[channel_id] = pile_version(pile_text)
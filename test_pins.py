@@ -1,4 +1,4 @@
-from bosspiles_discord import is_valid_bosspile, generate_status_checks
+from bosspiles import is_valid_bosspile, generate_status_checks
 
 def assert_equal(left, right):
     if left != right:
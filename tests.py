@@ -1,6 +1,35 @@
 # coding: utf-8
 """Limited tests."""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import sys
+import tempfile
+import types
+
+import discord
+
 from bosspiles import BossPile
+from bosspiles_cli import process_pile_file
+from bosspiles_bulk import apply_bulk_operation, check_bulk_args, format_bulk_summary, pile_diff
+from bosspiles_coordinator import COORDINATOR_PORT, CoordinatorClient, CoordinatorServer, claim_key, shard_for_guild
+from bosspiles_deploy import metrics_port, simulate_deployment
+from bosspiles_differential import find_divergence
+from bosspiles_fuzzy import DeletionIndex, get_index
+from bosspiles_history import ResultHistory
+from bosspiles_leaderboard import LeaderboardIndex
+from bosspiles_logging import SamplingFilter
+from bosspiles_members import MemberNameCache
+from bosspiles_metrics import METRICS_PORT_ENV, RATE_LIMITS, Counter, Histogram, REGISTRY, count_rate_limits
+from bosspiles_outbound import (PRIORITY_BULK, PRIORITY_PIN, CommandPlan, OutboundQueue, batch_messages, iter_message_parts,
+                                plan_sends)
+from bosspiles_ratings import RatingEngine
+from bosspiles_replay import read_logged_commands, replay
+from bosspiles_responses import ResponseCache
+from bosspiles_shards import ShardedPin
+from bosspiles_speculation import OutcomeCache
+from bosspiles_versions import PinVersions, pile_version, stamp_version
 
 
 POTION_EXPLOSION_BOSSPILE = """__**2-3P POTION EXPLOSION VBOSSPILE**__
@@ -107,12 +136,726 @@ Takorina :arrow_double_up:
     assert_equal(new_bosspile, bp.generate_bosspile())
 
 
+def test_log_sampling():
+    """Chatty templates are sampled per call site; other messages always pass."""
+    sampler = SamplingFilter(3, ["chatty `%s`"])
+    chatty = [logging.LogRecord("bp", logging.DEBUG, "", 0, "chatty `%s`", (i,), None) for i in range(7)]
+    other = logging.LogRecord("bp", logging.DEBUG, "", 0, "Received message `%s`", ("$w",), None)
+    assert_equal([True, False, False, True, False, False, True], [sampler.filter(r) for r in chatty])
+    assert_equal(True, sampler.filter(other))
+
+
+def test_metrics_render():
+    """Histograms render cumulative buckets; counters render one line per label set."""
+    latency = Histogram("test_latency_seconds", "Test latency.", ["call"], buckets=(0.1, 1))
+    calls = Counter("test_calls_total", "Test calls.", ["call"])
+    for value in [0.05, 0.5, 5]:
+        latency.observe(value, "pins")
+    calls.inc("send")
+    calls.inc("send")
+    REGISTRY.remove(latency)
+    REGISTRY.remove(calls)
+    expected = ['test_latency_seconds_bucket{call="pins",le="0.1"} 1',
+                'test_latency_seconds_bucket{call="pins",le="1"} 2',
+                'test_latency_seconds_bucket{call="pins",le="+Inf"} 3',
+                'test_latency_seconds_sum{call="pins"} 5.55',
+                'test_latency_seconds_count{call="pins"} 3',
+                'test_calls_total{call="send"} 2']
+    assert_equal(expected, list(latency.render()) + list(calls.render()))
+    # discord.py waits out 429s itself, so they are counted from its warnings
+    count_rate_limits("test.discord.http")
+    count_rate_limits("test.discord.http")
+    http_logger = logging.getLogger("test.discord.http")
+    http_logger.propagate = False
+    before = RATE_LIMITS.get("route"), RATE_LIMITS.get("global")
+    http_logger.warning("We are being rate limited. Retrying in %.2f seconds.", 1.5)
+    http_logger.warning("Global rate limit has been hit. Retrying in %.2f seconds.", 2.0)
+    http_logger.info("Not a rate limit")
+    assert_equal((before[0] + 1, before[1] + 1), (RATE_LIMITS.get("route"), RATE_LIMITS.get("global")))
+
+
+class FakeMessage:
+    """Stand-in for a discord message that records the calls made on it."""
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+        self.author = "bosspiles bot"
+        self.id = len(channel.calls)
+
+    async def edit(self, content):
+        self.channel.calls.append(("edit", content))
+        self.content = content
+
+    async def pin(self):
+        self.channel.calls.append(("pin", self.content))
+
+    async def unpin(self, reason):
+        self.channel.calls.append(("unpin", self.content))
+
+
+class FakeChannel:
+    """Stand-in for a discord channel that records the calls made on it."""
+    def __init__(self):
+        self.calls = []
+
+    async def send(self, content):
+        self.calls.append(("send", content))
+        return FakeMessage(self, content)
+
+
+def test_command_plan_round_trips():
+    """Notices share the reply message and contributor-only pin changes are skipped."""
+    channel = FakeChannel()
+    contrib = "\n_Hosting paid for until 2021-10-19._"
+    pin = FakeMessage(channel, POTION_EXPLOSION_BOSSPILE + contrib)
+    plan = CommandPlan(channel)
+    plan.count_calls()  # pins()
+    plan.edit_pin(ShardedPin([pin]), POTION_EXPLOSION_BOSSPILE, ignored_suffix=contrib)
+    plan.replace_pin("new pile", "Created new bosspile pin.")
+    plan.reply = "nmego has been added successfully."
+    asyncio.run(plan.execute())
+    expected_calls = [("send", "new pile"), ("pin", "new pile"),
+                      ("send", "nmego has been added successfully.\nCreated new bosspile pin.")]
+    assert_equal(expected_calls, channel.calls)
+    assert_equal(4, plan.round_trips)
+
+
+def test_status_batching():
+    """Status commands are packed per message and sends are spaced by global and per-channel limits."""
+    statuses = [f'!status splendor "p{i}" "q{i}"' for i in range(7)]
+    batches = batch_messages(statuses, 3)
+    assert_equal(3, len(batches))
+    assert_equal("\n".join(statuses[:3]), batches[0])
+    assert_equal(statuses[6], batches[2])
+    schedule = plan_sends([("a", ["a1", "a2", "a3"]), ("b", ["b1"])], global_interval=10, channel_interval=30)
+    expected = [(0, "a", "a1"), (10, "b", "b1"), (30, "a", "a2"), (60, "a", "a3")]
+    assert_equal(expected, schedule)
+
+
+def test_result_history():
+    """Wins, crowns and diamonds applied to a pile are queryable from the history."""
+    history = ResultHistory(":memory:")
+    bp = BossPile("potionexplosion", [], POTION_EXPLOSION_BOSSPILE)
+    bp.win("nmego")
+    history.record("potion-explosion-bosspile", bp.events, when=1000)
+    bp.events = []
+    bp.win("takorina")
+    history.record("potion-explosion-bosspile", bp.events, when=2000)
+    assert_equal(3, len(history.pending))
+    assert_equal(1, history.head_to_head("potion-explosion-bosspile", "nmego", "yourpetwerewolf"))
+    assert_equal((0, 1), history.win_loss("potion-explosion-bosspile", "YourPetWerewolf"))
+    assert_equal((1, 0), history.win_loss("potion-explosion-bosspile", "Takorina"))
+    assert_equal([(1000, "orange")], history.diamonds("potion-explosion-bosspile", "nmego (2P ok)"))
+    assert_equal(0, len(history.pending))
+    # The bot queries and flushes from a worker thread, not the one that opened the db
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as history_thread:
+        assert_equal((1, 0), history_thread.submit(history.win_loss, "potion-explosion-bosspile", "nmego").result())
+
+
+def test_boss_tenures():
+    """Boss tenures start with the first boss seen and follow changes that aren't crown wins,
+    and results are only recorded once the plan's pin changes have been made."""
+    history = ResultHistory(":memory:")
+    bp = BossPile("potionexplosion", [], POTION_EXPLOSION_BOSSPILE)
+    history.record("potionexplosion", bp.events, when=500, boss=bp.boss())
+    history.record("potionexplosion", bp.events, when=700, boss=bp.boss())  # Still nmego, so no new tenure
+    bp.remove("nmego")
+    history.record("potionexplosion", bp.events, when=1500, boss=bp.boss())
+    assert_equal([(500, 1000)], history.boss_tenures("potionexplosion", "nmego"))
+    assert_equal([(1500, 500)], history.boss_tenures("potionexplosion", "YourPetWerewolf", now=2000))
+    reloaded = ResultHistory(":memory:")
+    reloaded.db = history.db
+    assert_equal("yourpetwerewolf", reloaded.last_boss("potionexplosion"))
+
+    class FailingPin(FakeMessage):
+        async def edit(self, content):
+            raise ConnectionError("Discord is down")
+    channel = FakeChannel()
+    plan = CommandPlan(channel)
+    plan.edit_pin(ShardedPin([FailingPin(channel, POTION_EXPLOSION_BOSSPILE)]), "new pile")
+    saved = []
+    plan.on_saved.append(lambda: saved.append(True))
+    try:
+        asyncio.run(plan.execute())
+    except ConnectionError:
+        pass
+    assert_equal([], saved)
+
+
+def test_ratings_incremental_matches_recompute():
+    """Ratings updated one result at a time match a full recompute from the history."""
+    history = ResultHistory(":memory:")
+    engine = RatingEngine(history)
+    engine.recompute("rftg")
+    bp = BossPile("raceforthegalaxy", [], POTION_EXPLOSION_BOSSPILE)
+    for winner in ["sharzi", "nmego", "yourpetwerewolf"]:
+        bp.events = []
+        bp.win(winner)
+        history.record("rftg", bp.events)
+        engine.record("rftg", bp.events)
+    incremental = engine.ratings["rftg"]
+    assert_equal(incremental, engine.recompute("rftg"))
+    assert_equal(True, incremental["sharzi"] > 1500 > incremental["montesat"])
+    assert_equal(1500 * len(incremental), round(sum(incremental.values())))
+    assert_equal("1. Sharzi (2P ok)", engine.view("rftg", bp).split("\n")[1][:17])
+
+
+def test_fuzzy_player_names():
+    """Typos resolve to the one close player; ambiguous typos suggest; new players aren't fuzzy matched."""
+    bp = BossPile("potionexplosion", [], POTION_EXPLOSION_BOSSPILE + "\nsesquiup\nsesquiap")
+    assert_equal(("Takorina", 6, ""), bp.find_player_pos("takorna"))
+    assert_equal(("kingneal (2P ok)", 3, ""), bp.find_player_pos("KingNeil"))
+    expected_err = "Player sesquixp not found. Did you mean `sesquiup` or `sesquiap`? No changes made."
+    assert_equal(("sesquixp", -1, expected_err), bp.find_player_pos("sesquixp"))
+    assert_equal("Takorna has been added successfully.", bp.add("Takorna"))
+    # A channel's index is updated in place: reordering keeps it and changed keys match a fresh index
+    keys = ["takorina", "sesquiup", "montesat", "kingneal"]
+    index = get_index(keys, owner="fuzzy-test")
+    assert_equal(True, get_index(list(reversed(keys)), owner="fuzzy-test") is index)
+    updated = get_index(["takorina", "sesquiup", "montesats", "nmego"], owner="fuzzy-test")
+    fresh = DeletionIndex(["takorina", "sesquiup", "montesats", "nmego"])
+    assert_equal((fresh.keys, fresh.variants), (updated.keys, updated.variants))
+    assert_equal(True, get_index(keys) is get_index(list(reversed(keys))))
+
+
+def test_3p_bosspile_matches_text():
+    """Multiplayer tables tag the victor's new table, strip preferences and list the rest as waiting."""
+    nicknames = {"1": "kingneal", "2": "Takorina", "3": "nmego"}
+    bp = BossPile("potionexplosion", nicknames, POTION_EXPLOSION_BOSSPILE)
+    result = bp.win("sharzi")
+    expected_matches = """Sharzi (2P ok) defeats montesat, kingneal (2P ok)
+
+:crossed_swords: <@1> :vs: myopic2000 :vs: <@2>
+
+:hourglass: nmego :vs: YourPetWerewolf
+"""
+    assert_equal(expected_matches, result[:len(expected_matches)])
+
+
+def test_streaming_parser():
+    """Piles parsed from a lazy iterator of lines match piles parsed from text."""
+    from_text = BossPile("potionexplosion", [], POTION_EXPLOSION_BOSSPILE)
+    lines = (line + "\n" for line in POTION_EXPLOSION_BOSSPILE.split("\n"))
+    from_lines = BossPile("potionexplosion", [], lines)
+    assert_equal([p.__dict__ for p in from_text.players], [p.__dict__ for p in from_lines.players])
+    assert_equal(("__**2-3P POTION EXPLOSION VBOSSPILE**__", 2, 3),
+                 (from_lines.title_line, from_lines.min_players, from_lines.max_players))
+    assert_equal(from_text.generate_bosspile(), from_lines.generate_bosspile())
+
+
+def test_chunked_rendering():
+    """Rendered lines chunk the same as the joined pile, and breaks keep leading tabs visible."""
+    big_pile = POTION_EXPLOSION_BOSSPILE + "".join([f"\nplayer{i} (2P ok, long preference text)" for i in range(120)])
+    bp = BossPile("potionexplosion", [], big_pile)
+    parts = list(iter_message_parts(bp.iter_bosspile_lines()))
+    assert_equal(list(iter_message_parts(bp.generate_bosspile())), parts)
+    assert_equal(True, len(parts) > 1 and all([len(part) <= 2000 for part in parts]))
+    assert_equal(["a\nb\n", ".   c", "d\ne"], list(iter_message_parts(["a\n", "b\n", "\n\tc\n", "d\ne"], 5)))
+
+
+def test_sharded_pin_updates():
+    """A pile too long for one message is split across pins, reassembled, and a win only edits the shards it changes."""
+    channel = FakeChannel()
+    big_pile = POTION_EXPLOSION_BOSSPILE + "".join([f"\nplayer{i} (2P ok, long preference text)" for i in range(120)])
+    bp = BossPile("potionexplosion", [], big_pile)
+    plan = CommandPlan(channel)
+    plan.replace_pin(bp.generate_bosspile())
+    asyncio.run(plan.execute())
+    # Discord trims trailing whitespace off of messages
+    shards = [FakeMessage(channel, content.rstrip()) for call, content in channel.calls if call == "pin"]
+    assert_equal(3, len(shards))
+    pile_pin = ShardedPin(shards)
+    assert_equal(bp.generate_bosspile().rstrip(), pile_pin.content)
+    bp = BossPile("potionexplosion", [], pile_pin.content)
+    bp.win("player119")
+    channel.calls = []
+    plan = CommandPlan(channel)
+    plan.edit_pin(pile_pin, bp.generate_bosspile())
+    asyncio.run(plan.execute())
+    assert_equal(["edit"], [call for call, _ in channel.calls])
+    assert_equal(bp.generate_bosspile().rstrip(), ShardedPin(shards).content.rstrip())
+
+
+class FakeGuild:
+    """Guild that only answers query_members, like one with no member cache."""
+    def __init__(self, members):
+        self.id = 1
+        self.members = members
+        self.queries = []
+
+    async def query_members(self, query, limit, cache):
+        self.queries.append(query)
+        return [member for member in self.members if member.display_name.lower().startswith(query.lower())][:limit]
+
+
+def test_lean_member_names():
+    """Lean mode looks up only the ladder's players, once each, including names that match nobody."""
+    class Member:
+        def __init__(self, member_id, display_name):
+            self.id = member_id
+            self.display_name = display_name
+    guild = FakeGuild([Member(1, "Ross"), Member(2, "Takorina"), Member(3, "Bystander"), Member(4, "Rossi")])
+    cache = MemberNameCache()
+    nicknames = asyncio.run(cache.resolve(guild, ["Ross", "Takorina", "nobody"]))
+    assert_equal({"1": "Ross", "2": "Takorina"}, nicknames)
+    asyncio.run(cache.resolve(guild, ["Ross", "Takorina", "nobody"]))
+    assert_equal(["Ross", "Takorina", "nobody"], guild.queries)
+    # Expired names are dropped on a later resolve
+    cache.put(1, "gone", {}, now=-cache.ttl)
+    cache.next_prune = 0
+    asyncio.run(cache.resolve(guild, ["Ross"]))
+    assert_equal([(1, "nobody"), (1, "ross"), (1, "takorina")], sorted(cache.entries))
+
+
+def test_differential_against_reference():
+    """BossPile agrees with the frozen reference, and a broken engine is caught and shrunk."""
+    assert_equal(None, find_divergence(iterations=100, seed=1))
+
+    class DroppedTopMatch(BossPile):
+        def generate_matches(self):
+            return super().generate_matches()[:-1]
+    pile_text, commands, nicknames = find_divergence(iterations=100, seed=1, engine=DroppedTopMatch)
+    assert_equal(1, len(commands))
+    assert_equal(True, len(pile_text.split("\n")) <= 5)
+
+    # Nickname tagging is compared too, so a tagger that ignores the losers is caught
+    class VictorOnlyTags(BossPile):
+        def get_matches_text(self, victor, losers):
+            return super().get_matches_text(victor, [])
+    assert_equal(True, find_divergence(iterations=300, seed=1, engine=VictorOnlyTags) is not None)
+
+
+def test_guild_leaderboard():
+    """The index follows each channel's latest pile and answers for every game at once."""
+    leaderboard = LeaderboardIndex()
+    leaderboard.update(BossPile("potionexplosion-bosspile", [], POTION_EXPLOSION_BOSSPILE))
+    azul = BossPile("azul-bosspile", [], "__**Azul bosspile**__\n:crown: Takorina :small_orange_diamond:\n"
+                                         "nmego :arrow_double_up:\nmontesat\nkingneal :arrow_double_up:")
+    leaderboard.update(azul)
+    assert_equal("__**Takorina across 2 bosspiles**__\nazul: :crown: of 4 :small_orange_diamond:\npotionexplosion: #7 of 7",
+                 leaderboard.view("takorina"))
+    azul.win("nmego")
+    leaderboard.update(azul)
+    assert_equal([(1, True), (1, True)], [(standing.rank, standing.boss) for standing in leaderboard.lookup("NMEGO")[1]])
+    assert_equal("nmego", leaderboard.usernames[leaderboard.lookup("NMEGO")[0]])
+    azul.remove("Takorina")
+    leaderboard.update(azul)
+    assert_equal(["potionexplosion"], [standing.game for standing in leaderboard.lookup("Takorna")[1]])
+    assert_equal("nobody is not on any bosspile.", leaderboard.view("nobody"))
+    assert_equal(set(leaderboard.standings), leaderboard.fuzzy.keys)
+    leaderboard.update(BossPile("azul-bosspile", [], azul.generate_bosspile().replace("nmego", "NMego")))
+    assert_equal("NMego", leaderboard.usernames["nmego"])
+
+
+def test_offline_cli_replay():
+    """A pile file is replayed against its result log and re-rendered, with rejected commands reported."""
+    with tempfile.TemporaryDirectory() as export_dir:
+        with open(os.path.join(export_dir, "potionexplosion.txt"), "w") as f:
+            f.write(POTION_EXPLOSION_BOSSPILE.replace("nmego (2P ok)", ":small_orange_diamond: nmego (2P ok)"))
+        with open(os.path.join(export_dir, "potionexplosion.log"), "w") as f:
+            f.write("$win Takorina\n$win nobody\n")
+        result = process_pile_file(os.path.join(export_dir, "potionexplosion.txt"), export_dir)
+    expected = BossPile("potionexplosion", [], POTION_EXPLOSION_BOSSPILE.replace("nmego (2P ok)", ":small_orange_diamond: nmego (2P ok)"))
+    expected.win("Takorina")
+    assert_equal(expected.generate_bosspile(), result["pile"])
+    assert_equal(['!status potionexplosion "montesat" "kingneal" "Sharzi"', '!status potionexplosion "nmego" "YourPetWerewolf"'],
+                 result["status_checks"])
+    assert_equal(["potionexplosion.log:2: no change: Player nobody not found. No changes made."], result["unchanged"])
+    assert_equal([], result["errors"])
+
+
+def test_speculated_wins():
+    """Every precomputed win matches computing it on demand, and a changed pile gets no stale outcome."""
+    async def speculate_and_take():
+        cache = OutcomeCache()
+        cache.refresh("potionexplosion", {}, POTION_EXPLOSION_BOSSPILE)
+        await asyncio.gather(*cache.tasks)
+        results = []
+        for victor in ["Takorina", "myopic", "montesat", "kingneal", "Sharzi", "nmego", "YourPetWerewolf"]:
+            bosspile, reply, pile = cache.take("potionexplosion", POTION_EXPLOSION_BOSSPILE + "\n", {}, victor)
+            expected = BossPile("potionexplosion", {}, POTION_EXPLOSION_BOSSPILE)
+            results.append(reply == expected.win(victor) and pile == expected.generate_bosspile())
+        results.append(cache.take("potionexplosion", pile, {}, "Takorina") is None)
+        cache.refresh("potionexplosion", {}, pile)
+        results.append(cache.take("potionexplosion", POTION_EXPLOSION_BOSSPILE, {}, "Takorina") is None)
+        return results
+    assert_equal([True] * 9, asyncio.run(speculate_and_take()))
+
+
+def test_log_replay():
+    """Commands are read from the log with their channel, including multi-line ones, and replayed in order."""
+    log_lines = ["2026-10-01 10:00:00,000 | bosspiles_discord | DEBUG | Received message `$print`",
+                 "2026-10-01 10:00:01,000 | bosspiles_discord | DEBUG | Received message in #potionexplosion (1) `$win Takorina`",
+                 "2026-10-01 10:00:01,500 | bosspiles | DEBUG | *Is `x` a player on this server?*",
+                 "2026-10-01 10:00:02,000 | bosspiles_discord | DEBUG | Received message in #potionexplosion (1) `$edit \"Sharzi\" \"Sharzi",
+                 "(2P ok) :arrow_double_up:\"`",
+                 "2026-10-01 10:00:03,000 | bosspiles_discord | DEBUG | Received message in #azul (1) `$stats record Pocc`",
+                 "2026-10-01 10:00:04,000 | bosspiles_discord | DEBUG | Received message in #potionexplosion (2) `$print`",
+                 "2026-10-01 10:00:05,000 | bosspiles_discord | DEBUG | Received message in #DM (DM) `$stats record Pocc`"]
+    with tempfile.TemporaryDirectory() as log_dir:
+        with open(os.path.join(log_dir, "errs"), "w") as f:
+            f.write("\n".join(log_lines) + "\n")
+        commands = read_logged_commands([os.path.join(log_dir, "errs")])
+    assert_equal(["unknown", "potionexplosion", "potionexplosion", "azul", "potionexplosion", "DM"],
+                 [command.channel for command in commands])
+    assert_equal('$edit "Sharzi" "Sharzi\n(2P ok) :arrow_double_up:"', commands[2].content)
+    channels = {}
+    report = asyncio.run(replay(commands, {"potionexplosion": POTION_EXPLOSION_BOSSPILE}, standin=True, channels=channels))
+    assert_equal((["edit", "print", "win"], 3), (sorted(report.latencies), report.skipped))
+    # The same channel name in another guild has its own pile
+    assert_equal([("1", "potionexplosion"), ("2", "potionexplosion")], sorted(channels))
+    assert_equal(POTION_EXPLOSION_BOSSPILE.rstrip(), channels[("2", "potionexplosion")].pinned[0].content)
+
+
+def test_player_name_split_once():
+    """Name, preferences and key are split from the username when it is set and shared between piles."""
+    first = BossPile("potionexplosion", [], POTION_EXPLOSION_BOSSPILE)
+    second = BossPile("potionexplosion", [], POTION_EXPLOSION_BOSSPILE)
+    kingneal = first.players[3]
+    assert_equal(("kingneal (2P ok)", "kingneal", ("2P ok",), "kingneal"),
+                 (kingneal.username, kingneal.name, kingneal.preferences, kingneal.key))
+    assert_equal(True, all([a.name is b.name and a.key is b.key for a, b in zip(first.players, second.players)]))
+    kingneal.username = "King Neal (3P ok)"
+    assert_equal(("King Neal", ("3P ok",), "king neal"), (kingneal.name, kingneal.preferences, kingneal.key))
+    assert_equal({"username": "King Neal (3P ok)", "orange_diamonds": 0, "blue_diamonds": 0, "climbing": False,
+                  "active": True}, kingneal.fields())
+
+
+def test_outbound_queue_priorities():
+    """Pin edits go before replies and replies before bulk status lines, and a rate limit holds
+    only its channel before being retried."""
+    async def send_all(rate_limit_edit):
+        outbound = OutboundQueue(channel_interval=0, global_interval=0.05)
+        status_channel, command_channel = FakeChannel(), FakeChannel()
+        status_channel.calls = command_channel.calls  # One log of the order everything was sent in
+        pile_pin = FakeMessage(command_channel, "old pile")
+        rate_limited = []
+
+        async def edit_pin():
+            if rate_limit_edit and not rate_limited:
+                rate_limited.append(True)
+                raise discord.RateLimited(0.12)
+            await pile_pin.edit(content="new pile")
+        await asyncio.gather(*[outbound.send(status_channel, f"!status game {i}", PRIORITY_BULK) for i in range(2)],
+                             outbound.send(command_channel, "Takorina defeats myopic2000"),
+                             outbound.send(command_channel, "Bosspile being unpinned"),
+                             outbound.submit(command_channel, PRIORITY_PIN, "edit", edit_pin))
+        return command_channel.calls
+    status_calls = [("send", "!status game 0"), ("send", "!status game 1")]
+    command_calls = [("edit", "new pile"), ("send", "Takorina defeats myopic2000"), ("send", "Bosspile being unpinned")]
+    assert_equal(command_calls + status_calls, asyncio.run(send_all(rate_limit_edit=False)))
+    assert_equal(status_calls + command_calls, asyncio.run(send_all(rate_limit_edit=True)))
+
+
+def test_outbound_queue_merging():
+    """Waiting sends of one command to a channel go out as one message, but other commands' sends stay separate."""
+    async def send_all():
+        outbound = OutboundQueue(channel_interval=0, global_interval=0)
+        channel = FakeChannel()
+        first_command, second_command = object(), object()
+        # The edit keeps the channel busy until the sends are all waiting
+        await asyncio.gather(outbound.submit(channel, PRIORITY_PIN, "edit", lambda: asyncio.sleep(0.01)),
+                             outbound.send(channel, "Takorina defeats myopic2000", group=first_command),
+                             outbound.send(channel, "Created new bosspile pin.", group=first_command),
+                             outbound.send(channel, "nmego has been added successfully.", group=second_command),
+                             outbound.send(channel, "Weekly status check has triggered."))
+        return channel.calls
+    assert_equal([("send", "Takorina defeats myopic2000\nCreated new bosspile pin."),
+                  ("send", "nmego has been added successfully."), ("send", "Weekly status check has triggered.")],
+                 asyncio.run(send_all()))
+
+
+def test_outbound_queue_failures():
+    """A call that fails before it is awaited fails only its caller, and a slow channel doesn't hold up others."""
+    async def send_all():
+        outbound = OutboundQueue(channel_interval=0, global_interval=0)
+        slow_channel, fast_channel = FakeChannel(), FakeChannel()
+        fast_channel.calls = slow_channel.calls
+
+        async def slow_edit():
+            await asyncio.sleep(0.1)
+            slow_channel.calls.append(("edit", "slow"))
+
+        def broken_call():
+            raise ValueError("bad call")
+        results = await asyncio.gather(outbound.submit(slow_channel, PRIORITY_PIN, "edit", slow_edit),
+                                       outbound.submit(fast_channel, PRIORITY_PIN, "send", broken_call),
+                                       outbound.send(fast_channel, "fast reply"), return_exceptions=True)
+        return [type(result).__name__ for result in results], slow_channel.calls
+    assert_equal((["NoneType", "ValueError", "FakeMessage"], [("send", "fast reply"), ("edit", "slow")]),
+                 asyncio.run(send_all()))
+
+
+def test_bulk_operations():
+    """A bulk rename keeps diamonds and preferences, only whole names match, and the summary lists each pile's diff."""
+    potion = BossPile("potionexplosion", [], POTION_EXPLOSION_BOSSPILE.replace("kingneal (2P ok)", ":small_orange_diamond: kingneal (2P ok)"))
+    azul = BossPile("azul", [], "__**Azul bosspile**__\n:crown: Takorina\nkingneal :arrow_double_up:\nmontesat")
+    results = []
+    for bosspile in [potion, azul]:
+        old_pile = bosspile.generate_bosspile()
+        reply = apply_bulk_operation(bosspile, "rename", "KingNeal", "kneal")
+        results.append((bosspile.channel_name, reply, pile_diff(old_pile, bosspile.generate_bosspile()), None))
+    assert_equal(None, apply_bulk_operation(azul, "remove", "king"))
+    results += [("splendor", None, [], None), ("7wonders", None, [], "Forbidden: 403 Missing Permissions")]
+    expected = """__**Bulk rename of KingNeal (dry run, add `confirm` to apply)**__
+#7wonders: failed, no changes made: Forbidden: 403 Missing Permissions
+#azul: `- kingneal :arrow_double_up:`  `+ kneal :arrow_double_up:`
+#potionexplosion: `- :small_orange_diamond: kingneal (2P ok)`  `+ :small_orange_diamond: kneal (2P ok)`
+Not on 1 other piles."""
+    assert_equal(expected, format_bulk_summary("rename", "KingNeal", results, dry_run=True))
+    # A name that another player's name starts with is still matched exactly
+    pocc = BossPile("azul", [], "__**Azul bosspile**__\n:crown: Takorina\nPocc2 :arrow_double_up:\nmontesat\nPocc")
+    assert_equal(["Pocc has been removed.", "Pocc2 is now Pocc.", "takorina is already in the bosspile. No changes made."],
+                 [apply_bulk_operation(pocc, "remove", "Pocc"), apply_bulk_operation(pocc, "rename", "Pocc2", "Pocc"),
+                  apply_bulk_operation(pocc, "rename", "Pocc", "takorina")])
+    assert_equal(["Unable to parse line `Pocc :timer:`.", "Pocc"],
+                 [apply_bulk_operation(pocc, "rename", "Pocc", "Pocc :timer:").splitlines()[0], pocc.players[1].username])
+    assert_equal([True, False, True, False, True],
+                 [bool(check_bulk_args("remove", [])), bool(check_bulk_args("remove", ["Pocc"])),
+                  bool(check_bulk_args("rename", ["Pocc", "Smith", "Pocc2"])),
+                  bool(check_bulk_args("rename", ["Pocc Smith", "Pocc2"])), bool(check_bulk_args(None, ["Pocc"]))])
+
+
+def test_pile_version_stamps():
+    """Stamped piles parse the same, old stamps with a checksum still parse, and a pile is stale once
+    a newer version has been seen on its channel."""
+    bp = BossPile("potionexplosion", [], POTION_EXPLOSION_BOSSPILE)
+    base = stamp_version(bp.generate_bosspile(), 7).rstrip()  # As Discord stores it
+    assert_equal((7, "-# v7"), (pile_version(base), base.split("\n")[1]))
+    assert_equal(bp.generate_bosspile(), BossPile("potionexplosion", [], base).generate_bosspile())
+    assert_equal(3, pile_version(base.replace("-# v7", "-# v3 1a2b3c4d")))
+    bp.win("Takorina")
+    versions = PinVersions()
+    versions.see(1, base)
+    fresh = [versions.is_stale(1, base), versions.is_stale(2, POTION_EXPLOSION_BOSSPILE)]
+    versions.see(1, stamp_version(bp.generate_bosspile(), 8))  # Saved by another instance
+    versions.see(1, stamp_version(bp.generate_bosspile(), 6))
+    assert_equal([False, False, True, False], fresh + [versions.is_stale(1, base), versions.is_stale(2, base)])
+
+
+class PinnedChannel:
+    """Stand-in for a discord channel that keeps its pins, for running whole commands."""
+    def __init__(self, channel_id, name, bot_user):
+        self.id = channel_id
+        self.name = name
+        self.bot_user = bot_user
+        self.pinned = []  # Newest first, like Discord
+        self.messages = {}
+
+    async def pins(self):
+        return list(self.pinned)
+
+    async def send(self, content, author=None):
+        message = PinnedMessage(self, content, author or self.bot_user)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        return self.messages[int(message_id)]
+
+
+class PinnedMessage:
+    def __init__(self, channel, content, author):
+        self.channel = channel
+        self.content = content.rstrip()
+        self.author = author
+        self.id = len(channel.messages) + 1
+
+    async def edit(self, content):
+        self.content = content.rstrip()
+
+    async def pin(self):
+        self.channel.pinned.insert(0, self)
+
+    async def unpin(self, reason):
+        self.channel.pinned.remove(self)
+
+
+def test_repin_after_unpin():
+    """After `$unpin`, a new pin (by the bot, by `$pin` or by a person) is saved to again instead of being stale."""
+    sys.modules.setdefault("keys", types.SimpleNamespace(TOKEN=""))  # The token is only needed to connect
+    import bosspiles_discord
+    bosspiles_discord.history = ResultHistory(":memory:")
+    bosspiles_discord.ratings = RatingEngine(bosspiles_discord.history)
+    bot_user = types.SimpleNamespace(id=1)
+    admin = types.SimpleNamespace(id=2, guild_permissions=types.SimpleNamespace(administrator=True))
+    bosspiles_discord.client._connection.user = bot_user
+    channel = PinnedChannel(4601, "potionexplosion", bot_user)
+    guild = types.SimpleNamespace(id=7, members=[])
+
+    async def run_commands(commands):
+        replies = []
+        for command in commands:
+            plan = CommandPlan(channel)
+            message = types.SimpleNamespace(content=command, channel=channel, guild=guild, author=admin)
+            plan.reply = await bosspiles_discord.run_bosspiles(message, plan)
+            await plan.execute()
+            replies.append(plan.reply)
+        return replies
+
+    async def run_all():
+        first_pin = await channel.send(stamp_version(POTION_EXPLOSION_BOSSPILE, 3))
+        await first_pin.pin()
+        replies = await run_commands(["$new b1", "$unpin reset"])
+        by_hand = await channel.send(POTION_EXPLOSION_BOSSPILE, author=admin)
+        replies += await run_commands([f"$pin {by_hand.id}", "$new b2", "$unpin reset"])
+        await by_hand.pin()
+        replies += await run_commands(["$new b3", "$new b4"])
+        return replies, by_hand.id
+    replies, by_hand_id = asyncio.run(run_all())
+    bosspiles_discord.history_executor.submit(lambda: None).result()  # Let the recorded results finish
+    assert_equal(["b1 has been added successfully.", "", f"Pinned {by_hand_id} successfully!", "b2 has been added successfully.",
+                  "", "b3 has been added successfully.", "b4 has been added successfully."], replies)
+    pile = channel.pinned[0].content
+    assert_equal((1, True, False, True), (len([pin for pin in channel.pinned if pin.author is bot_user]),
+                                          "\nb4" in pile, "\nb2" in pile, pile_version(pile) > 4))
+
+
+def test_sharded_coordinator():
+    """Across shard processes each channel's weekly status check is claimed once and its commands never overlap,
+    and a shard that drops its connection gives up the locks it held."""
+    guild_channels = {419535969507606529: ["azul", "splendor"], 700000000000000000: ["potionexplosion"],
+                      123456789012345678: ["carcassonne", "7wonders"]}
+    events = sorted(simulate_deployment(3, guild_channels), key=lambda event: event[3])
+    for channel in ["azul", "splendor", "potionexplosion", "carcassonne", "7wonders"]:
+        steps = [(shard, step) for event_channel, shard, step, when in events if event_channel == channel]
+        assert_equal(1, len([step for shard, step in steps if step == "status"]))
+        runs = [(shard, step) for shard, step in steps if step != "status"]
+        assert_equal(["start", "end"] * 3, [step for shard, step in runs])
+        assert_equal(True, all(runs[i][0] == runs[i + 1][0] for i in range(0, len(runs), 2)))
+    # Discord's mapping: the guild id's timestamp bits modulo the shard count
+    assert_equal([0, 1, 0, 2], [shard_for_guild(guild_id, 3) for guild_id in [*guild_channels, 123456789020734286]])
+    assert_equal({"azul": 0, "splendor": 0, "potionexplosion": 1, "carcassonne": 0, "7wonders": 0},
+                 {channel: shard for channel, shard, step, when in simulate_deployment(3, guild_channels, overlap=False)})
+
+    async def drop_while_locked():
+        server = CoordinatorServer()
+        port = await server.start(port=0)
+        dropped, waiting = await CoordinatorClient(port=port).connect(), await CoordinatorClient(port=port).connect()
+        await dropped.request("lock", "channel:1")
+        acquired = asyncio.ensure_future(waiting.request("lock", "channel:1"))
+        await asyncio.sleep(0.05)
+        held_elsewhere = acquired.done()
+        await dropped.close()
+        await asyncio.wait_for(acquired, 1)
+        claims = [await waiting.claim("status:1:2026-W01"), await waiting.claim("status:1:2026-W01")]
+        await waiting.close()
+        await server.close()
+        return held_elsewhere, claims
+    assert_equal((False, [True, False]), asyncio.run(drop_while_locked()))
+
+    async def lose_coordinator():
+        server = CoordinatorServer()
+        port = await server.start(port=0)
+        client = await CoordinatorClient(port=port).connect()
+        first_claim = await client.claim("status:1:2026-W01")
+        await server.close()
+        client.writer.close()  # As if the coordinator had gone away
+        await client.responses
+        async with client.channel_lock("channel:1"):  # In-process while it's gone
+            fallback_claims = [await client.claim("status:2:2026-W01"), await client.claim("status:2:2026-W01")]
+        reconnecting = client.reconnecting is not None and not client.reconnecting.done()
+        await client.close()
+        return first_claim, fallback_claims, reconnecting
+    assert_equal((True, [True, False], True), asyncio.run(lose_coordinator()))
+    claims = {"status:1:2026-W01": 0}  # Long expired
+    assert_equal([True, False, ["status:1:2026-W01"]],
+                 [claim_key(claims, "status:1:2026-W01"), claim_key(claims, "status:1:2026-W01"), list(claims)])
+    # Each shard's metrics port is its own and never the coordinator's, even with --port in the metrics range
+    for coordinator_port in [COORDINATOR_PORT, 9480]:
+        ports = [metrics_port(shard_id, coordinator_port) for shard_id in range(64)]
+        assert_equal((64, False), (len(set(ports)), coordinator_port in ports))
+
+
+def test_metrics_port_taken():
+    """A metrics port that is already in use is logged instead of stopping on_ready."""
+    sys.modules.setdefault("keys", types.SimpleNamespace(TOKEN=""))  # The token is only needed to connect
+    import bosspiles_discord
+
+    async def start_on_taken_port():
+        taken = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+        os.environ[METRICS_PORT_ENV] = str(taken.sockets[0].getsockname()[1])
+        try:
+            await bosspiles_discord.start_metrics()
+        finally:
+            del os.environ[METRICS_PORT_ENV]
+            taken.close()
+        return bosspiles_discord.metrics_server
+    assert_equal(None, asyncio.run(start_on_taken_port()))
+
+
+def test_static_responses():
+    """Static replies are transformed and split once, and only reloaded when their file changes."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        help_path = os.path.join(tmp_dir, "help_text.md")
+        with open(help_path, "w") as f:
+            f.write("\n".join([f"    `$win {i}` reports a win" for i in range(150)]))
+        responses = ResponseCache()
+        responses.register("help", help_path, lambda text: text.replace(4 * " ", "\t"), "No help yet")
+        assert_equal("No help yet", responses.text("help"))  # Nothing is read until the first refresh
+        assert_equal(["help"], responses.refresh())
+        help_text = responses.text("help")
+        assert_equal((True, list(iter_message_parts(help_text))),
+                     (help_text.startswith("\t`$win 0`"), list(responses.parts_for(help_text))))
+        assert_equal([[], None], [responses.refresh(), responses.parts_for("Not a static reply")])
+        plan = CommandPlan(None)
+        plan.reply, plan.reply_parts = help_text, responses.parts_for(help_text)
+        assert_equal(responses.parts_for(help_text)[1], plan.message_parts()[1])
+        with open(help_path, "w") as f:
+            f.write("    `$` shows this")
+        assert_equal((["help"], "\t`$` shows this"), (responses.refresh(), responses.text("help")))
+        os.remove(help_path)
+        warnings = []
+        handler = logging.Handler(logging.WARNING)
+        handler.emit = warnings.append
+        logging.getLogger("bosspiles_responses").addHandler(handler)
+        assert_equal(([], "\t`$` shows this"), (responses.refresh(), responses.text("help")))
+        assert_equal([[], 1], [responses.refresh(), len(warnings)])  # Only logged when it goes missing
+        with open(help_path, "w") as f:
+            f.write("    `$` shows this again")
+        assert_equal(["help"], responses.refresh())
+        os.remove(help_path)
+        assert_equal([[], [], 2], [responses.refresh(), responses.refresh(), len(warnings)])
+        logging.getLogger("bosspiles_responses").removeHandler(handler)
+        missing = ResponseCache()
+        missing.register("help", os.path.join(tmp_dir, "missing.md"), fallback="No help yet")
+        assert_equal(([], "No help yet"), (missing.refresh(), missing.text("help")))
+
+
 def main():
     test_2p_bosspile_crown_win()
     test_3p_bosspile_2p_win()
     test_3p_bosspile_3p_bottom_player_wins()
     test_3p_bosspile_3p_middle_player_wins()
     test_3p_bosspile_3p_top_player_wins()
+    test_log_sampling()
+    test_metrics_render()
+    test_command_plan_round_trips()
+    test_status_batching()
+    test_result_history()
+    test_boss_tenures()
+    test_ratings_incremental_matches_recompute()
+    test_fuzzy_player_names()
+    test_3p_bosspile_matches_text()
+    test_streaming_parser()
+    test_chunked_rendering()
+    test_sharded_pin_updates()
+    test_lean_member_names()
+    test_differential_against_reference()
+    test_guild_leaderboard()
+    test_offline_cli_replay()
+    test_speculated_wins()
+    test_log_replay()
+    test_player_name_split_once()
+    test_outbound_queue_priorities()
+    test_outbound_queue_merging()
+    test_outbound_queue_failures()
+    test_bulk_operations()
+    test_pile_version_stamps()
+    test_repin_after_unpin()
+    test_sharded_coordinator()
+    test_metrics_port_taken()
+    test_static_responses()
 
 
 # Catching past errors
@@ -292,9 +1035,9 @@ saltybream :arrow_double_up:"""
 
 andycupid (GS, AA, RI, XI) has lost the :crown: to Gilderoy (GS, RI, BW, XIi)
 andycupid (GS, AA, RI, XI) goes down 1 spaces.
-2+ player matchups partially implemented.
-:hourglass: Pocc (AA, RI, GS, BW, XI) :vs: saltybream
-:hourglass: andycupid (GS, AA, RI, XI) :vs: nmego (Xli, XI, AA, RI, GS, BoW, Base) :vs: tarpshack (AA, GS, RI, BW, AAo) :vs: Justin Jake
+:crossed_swords: andycupid :vs: nmego :vs: tarpshack :vs: Justin Jake
+
+:hourglass: Pocc :vs: saltybream
 
 __**3-4P RFTG VBOSSPILE**__
 